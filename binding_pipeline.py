@@ -0,0 +1,519 @@
+import time
+import heapq
+import random
+import threading
+from collections import deque
+from kubernetes import client, watch
+from kubernetes.client import V1ObjectReference, V1ObjectMeta
+from kubernetes.client.exceptions import ApiException
+from urllib3.exceptions import HTTPError
+from scheduler import pod_requests
+import instrumentation
+
+BIND_SECONDS = instrumentation.histogram('bind_seconds', 'Time to bind a pod, including retries.')
+BIND_ERRORS = instrumentation.counter('bind_errors_total',
+                                     'Failed binding attempts by HTTP status or transport error.', ['status'])
+DECISION_SECONDS = instrumentation.histogram('scheduling_decision_seconds', 'Time to pick and reserve a node.')
+
+# Binding errors worth another attempt: conflicts, throttling and API server hiccups
+RETRY_STATUSES = {409, 429, 500, 502, 503, 504}
+
+
+class WorkQueue:
+    """
+    FIFO of pending pods keyed by pod UID.
+
+    A key is queued at most once: adding it again while it waits only refreshes the
+    pod object, adding it while a worker holds it parks the newest object until the
+    worker calls ``done``. ``add_after`` holds a key back for a delay, as a
+    rate-limited re-add of pods that could not be placed yet.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.keys = deque()
+        self.items = {}
+        self.processing = set()
+        self.dirty = {}
+        # key -> (ready time, item) of delayed re-adds, ordered through the heap
+        self.waiting = {}
+        self.heap = []
+        self.shutting_down = False
+
+    def _add(self, key, item):
+        if key in self.items:
+            self.items[key] = item
+        elif key in self.processing:
+            self.dirty[key] = item
+        else:
+            self.items[key] = item
+            self.keys.append(key)
+            self.condition.notify()
+
+    def add(self, key, item):
+        with self.condition:
+            self.waiting.pop(key, None)
+            self._add(key, item)
+
+    def add_after(self, key, item, delay):
+        """Add ``key`` once ``delay`` seconds have passed."""
+        with self.condition:
+            ready = time.monotonic() + delay
+            self.waiting[key] = (ready, item)
+            heapq.heappush(self.heap, (ready, key))
+            self.condition.notify()
+
+    def _promote(self):
+        """Move due delayed keys into the queue, return seconds until the next one is due."""
+        now = time.monotonic()
+        while self.heap:
+            ready, key = self.heap[0]
+            entry = self.waiting.get(key)
+            if entry is None or entry[0] != ready:
+                heapq.heappop(self.heap)
+            elif ready <= now:
+                heapq.heappop(self.heap)
+                del self.waiting[key]
+                self._add(key, entry[1])
+            else:
+                return ready - now
+        return None
+
+    def get(self):
+        """Block until a key is available, return ``(key, item)`` or None after shutdown."""
+        with self.condition:
+            while True:
+                timeout = self._promote()
+                if self.keys or self.shutting_down:
+                    break
+                self.condition.wait(timeout)
+            if not self.keys:
+                return None
+            key = self.keys.popleft()
+            self.processing.add(key)
+            return key, self.items.pop(key)
+
+    def done(self, key):
+        with self.condition:
+            self.processing.discard(key)
+            if key in self.dirty:
+                self.items[key] = self.dirty.pop(key)
+                self.keys.append(key)
+                self.condition.notify()
+
+    def discard(self, key):
+        """Drop a parked or delayed re-add, e.g. once the pod is known to be bound or deleted."""
+        with self.condition:
+            self.dirty.pop(key, None)
+            self.waiting.pop(key, None)
+
+    def shutdown(self):
+        with self.condition:
+            self.shutting_down = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        with self.condition:
+            return len(self.keys) + len(self.waiting)
+
+
+class BindingPipeline:
+    """
+    Watch Pending pods, queue them by UID and bind them from a pool of workers.
+
+    The watcher resumes from the last resourceVersion it saw, including bookmarks, and
+    only re-lists when the API server reports that version as expired. Each worker
+    reserves a node through the scheduler and sends the binding, retrying with
+    exponential backoff on conflicts and transient errors. A pod that fits no node, or
+    whose binding keeps failing, is queued again after a per-pod delay that doubles up
+    to ``max_requeue_delay``, since a Pending pod gets no new watch event to bring it back.
+    """
+
+    def __init__(self, v1, scheduler, namespace='default', workers=8, max_retries=5, backoff=0.1,
+                 watch_timeout=300, requeue_delay=0.5, max_requeue_delay=10.0):
+        """
+        :param v1: A ``CoreV1Api`` client.
+        :param scheduler: A ``scheduler.Scheduler`` whose cache receives the reservations.
+        :param namespace: Namespace whose Pending pods are scheduled.
+        :param workers: Number of bindings sent in parallel.
+        :param max_retries: Retries per binding before giving up.
+        :param backoff: First retry delay in seconds, doubled on every retry.
+        :param watch_timeout: Server-side timeout of one watch request in seconds.
+        :param requeue_delay: First delay before an unplaced pod is tried again, doubled per attempt.
+        :param max_requeue_delay: Upper bound of that delay in seconds.
+        """
+        self.v1 = v1
+        self.scheduler = scheduler
+        self.namespace = namespace
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.watch_timeout = watch_timeout
+        self.requeue_delay = requeue_delay
+        self.max_requeue_delay = max_requeue_delay
+        self.queue = WorkQueue()
+        # uid -> number of times the pod was queued again without being bound
+        self.requeues = {}
+        # uid -> node of pods bound by us whose watch event has not shown the node yet
+        self.bound = {}
+        self.stopped = threading.Event()
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.bind_latency = deque(maxlen=1024)
+        self.counters = {'bound': 0, 'failed': 0, 'retries': 0, 'unschedulable': 0, 'requeued': 0, 'duplicates': 0,
+                         'relists': 0}
+
+    def _count(self, name, value=1):
+        with self.stats_lock:
+            self.counters[name] += value
+
+    def offer(self, event_type, pod):
+        """Queue a pod from a list or watch event if it still needs a node."""
+        if not pod.metadata or not pod.metadata.name or not pod.metadata.namespace:
+            print("Pod metadata is missing or incomplete.")
+            return
+        uid = pod.metadata.uid
+        if event_type == 'DELETED' or pod.spec.node_name:
+            self.bound.pop(uid, None)
+            self.requeues.pop(uid, None)
+            self.queue.discard(uid)
+            return
+        if pod.status.phase != 'Pending':
+            return
+        if uid in self.bound:
+            self._count('duplicates')
+            return
+        self.queue.add(uid, pod)
+
+    def watch_pods(self):
+        resource_version = None
+        while not self.stopped.is_set():
+            w = watch.Watch()
+            try:
+                if resource_version is None:
+                    pod_list = self.v1.list_namespaced_pod(self.namespace)
+                    for pod in pod_list.items:
+                        self.offer('ADDED', pod)
+                    resource_version = pod_list.metadata.resource_version
+                for event in w.stream(self.v1.list_namespaced_pod, namespace=self.namespace,
+                                      resource_version=resource_version, allow_watch_bookmarks=True,
+                                      timeout_seconds=self.watch_timeout):
+                    if event['type'] != 'BOOKMARK':
+                        self.offer(event['type'], event['object'])
+                    if self.stopped.is_set():
+                        w.stop()
+                resource_version = w.resource_version or resource_version
+            except ApiException as e:
+                if e.status == 410:
+                    # Our resourceVersion is older than the API server keeps, start from a fresh list
+                    self._count('relists')
+                    resource_version = None
+                else:
+                    print(f"Watch failed: {e.status} {e.reason}")
+                    resource_version = w.resource_version or resource_version
+                    time.sleep(1)
+            except Exception as e:
+                print(f"Watch failed: {e}")
+                resource_version = w.resource_version or resource_version
+                time.sleep(1)
+
+    def bind(self, pod, node_name):
+        """
+        Send the binding of ``pod`` to ``node_name``.
+
+        :return: True if the API server accepted the binding, None if the pod no longer
+                 exists, False if the binding should be tried again later.
+        """
+        binding = client.V1Binding(
+            api_version="v1",
+            kind="Binding",
+            target=V1ObjectReference(api_version="v1", kind="Node", name=node_name),
+            metadata=V1ObjectMeta(name=pod.metadata.name)
+        )
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                # The response is not needed, skip deserializing it (the API server answers with a
+                # Status, not a Binding) but read it so the connection goes back to the pool
+                response = self.v1.create_namespaced_pod_binding(name=pod.metadata.name,
+                                                                 namespace=pod.metadata.namespace,
+                                                                 body=binding, _preload_content=False)
+                response.drain_conn()
+                response.release_conn()
+                latency = time.perf_counter() - start
+                BIND_SECONDS.observe(latency)
+                with self.stats_lock:
+                    self.bind_latency.append(latency)
+                    self.counters['bound'] += 1
+                return True
+            except ApiException as e:
+                BIND_ERRORS.inc(str(e.status))
+                if e.status not in RETRY_STATUSES or attempt == self.max_retries:
+                    self._count('failed')
+                    print(f"Error binding pod {pod.metadata.name} to node {node_name}: {e.status} {e.reason}")
+                    return None if e.status == 404 else False
+                self._count('retries')
+            except (HTTPError, OSError) as e:
+                # Connection refused or reset, read timeouts: the binding may be sent again
+                BIND_ERRORS.inc(type(e).__name__)
+                if attempt == self.max_retries:
+                    self._count('failed')
+                    print(f"Error binding pod {pod.metadata.name} to node {node_name}: {e}")
+                    return False
+                self._count('retries')
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def process(self, pod):
+        uid = pod.metadata.uid
+        if uid in self.bound:
+            return
+        requests = pod_requests(pod)
+        if not requests:
+            print(f"Resource requests not found for pod {pod.metadata.name}")
+            return
+        cpu_request, memory_request = requests
+        with DECISION_SECONDS.time():
+            node_name = self.scheduler.reserve(pod, cpu_request, memory_request)
+        if node_name is None:
+            self._count('unschedulable')
+            if instrumentation.VERBOSE:
+                print(f"No node fits pod {pod.metadata.name}")
+            self.requeue(pod)
+            return
+        try:
+            bound = self.bind(pod, node_name)
+        except Exception:
+            # Release the reservation and try again later, work() reports the error
+            self.scheduler.cache.forget(uid)
+            self.requeue(pod)
+            raise
+        if bound:
+            self.bound[uid] = node_name
+            self.requeues.pop(uid, None)
+            self.queue.discard(uid)
+            if instrumentation.VERBOSE:
+                print(f"Pod {pod.metadata.name} scheduled to node {node_name}")
+        else:
+            self.scheduler.cache.forget(uid)
+            if bound is False:
+                self.requeue(pod)
+
+    def requeue(self, pod):
+        """Queue ``pod`` again after its exponential per-pod delay."""
+        uid = pod.metadata.uid
+        attempts = self.requeues.get(uid, 0)
+        self.requeues[uid] = attempts + 1
+        self._count('requeued')
+        self.queue.add_after(uid, pod, min(self.requeue_delay * 2 ** attempts, self.max_requeue_delay))
+
+    def work(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            uid, pod = entry
+            try:
+                self.process(pod)
+            except Exception as e:
+                print(f"Error scheduling pod {pod.metadata.name}: {e}")
+            finally:
+                self.queue.done(uid)
+
+    def stats(self):
+        """Queue depth, counters and bind latency percentiles (seconds) of the pipeline."""
+        with self.stats_lock:
+            latency = sorted(self.bind_latency)
+            stats = {'queue_depth': len(self.queue), 'in_flight': len(self.queue.processing), **self.counters}
+        if latency:
+            stats['bind_latency_p50'] = latency[len(latency) // 2]
+            stats['bind_latency_p99'] = latency[min(len(latency) - 1, int(len(latency) * 0.99))]
+            stats['bind_latency_max'] = latency[-1]
+        return stats
+
+    def report(self, interval):
+        while not self.stopped.wait(interval):
+            stats = self.stats()
+            print(' '.join(f"{key}={round(value, 4)}" for key, value in stats.items()))
+
+    def start(self, stats_interval=None):
+        """Start the watcher and workers on daemon threads, and a stats printer if ``stats_interval`` is set."""
+        targets = [self.watch_pods] + [self.work] * self.workers
+        if stats_interval:
+            targets.append(lambda: self.report(stats_interval))
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        self.queue.shutdown()
+
+
+def run_fake_api_server(pods=300, conflict_every=10, bind_delay=0.01):
+    """
+    Serve a burst of Pending pods and accept bindings like a small API server.
+
+    The first watch streams every pod as ADDED followed by a duplicate MODIFIED and a
+    BOOKMARK; the next watch answers 410 Gone once to force a re-list. Every
+    ``conflict_every``-th pod gets a 409 Conflict on its first binding.
+
+    :return: ``(server, url, bindings)``, bindings maps pod name to accepted bindings and
+             ``server.connections`` counts the TCP connections accepted.
+    """
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    names = [f'batch-{i}' for i in range(pods)]
+    bindings = {name: 0 for name in names}
+    attempts = {name: 0 for name in names}
+    watches = []
+    lock = threading.Lock()
+
+    def pod_json(name, resource_version):
+        return {'apiVersion': 'v1', 'kind': 'Pod',
+                'metadata': {'name': name, 'namespace': 'default', 'uid': f'uid-{name}', 'resourceVersion': str(resource_version)},
+                'spec': {'containers': [{'name': 'main', 'image': 'busybox',
+                                         'resources': {'requests': {'cpu': '100m', 'memory': '64Mi'}}}]},
+                'status': {'phase': 'Pending'}}
+
+    class FakeApiServer(BaseHTTPRequestHandler):
+        # Keep-alive like the real API server, so the benchmark sees whether connections are reused
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            if query.get('watch') != ['true']:
+                with lock:
+                    items = [pod_json(name, 1) for name in names if not bindings[name]]
+                self._send(200, {'apiVersion': 'v1', 'kind': 'PodList', 'metadata': {'resourceVersion': '1000'},
+                                 'items': items})
+                return
+            with lock:
+                watches.append(query.get('resourceVersion', [None])[0])
+                count = len(watches)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            # The stream has no length, it ends when the server closes the connection
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            if count == 1:
+                for i, name in enumerate(names):
+                    for event_type in ('ADDED', 'MODIFIED'):
+                        event = {'type': event_type, 'object': pod_json(name, 10 + i)}
+                        self.wfile.write(json.dumps(event).encode() + b'\n')
+                bookmark = {'type': 'BOOKMARK', 'object': {'kind': 'Pod', 'apiVersion': 'v1',
+                                                           'metadata': {'resourceVersion': '5000'}}}
+                self.wfile.write(json.dumps(bookmark).encode() + b'\n')
+            elif count == 2:
+                gone = {'type': 'ERROR', 'object': {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure',
+                                                    'reason': 'Expired', 'message': 'too old resource version',
+                                                    'code': 410}}
+                self.wfile.write(json.dumps(gone).encode() + b'\n')
+            else:
+                time.sleep(0.2)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            name = self.path.split('/')[-2]
+            time.sleep(bind_delay)
+            with lock:
+                attempts[name] += 1
+                conflict = names.index(name) % conflict_every == 0 and attempts[name] == 1
+                if not conflict:
+                    bindings[name] += 1
+            if conflict:
+                self._send(409, {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure', 'reason': 'Conflict',
+                                 'message': 'the object has been modified', 'code': 409})
+            else:
+                self._send(201, {'kind': 'Binding', 'apiVersion': 'v1'})
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 128
+        daemon_threads = True
+        connections = 0
+
+        def process_request(self, request, client_address):
+            self.connections += 1
+            super().process_request(request, client_address)
+
+    server = Server(('127.0.0.1', 0), FakeApiServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}', bindings
+
+
+def benchmark(pods=300, scenarios=((1, 20, 8, None), (16, 20, 8, None), (16, 4, 2, 0.5))):
+    """
+    Drive the pipeline against the fake API server and check every pod is bound exactly once.
+
+    :param scenarios: ``(workers, nodes, cores per node, job seconds)`` tuples. With job
+                      seconds set, each bound pod releases its requests that long after
+                      binding, as if it completed; the last default scenario is a burst of
+                      100m pods four times larger than the cluster, which only finishes if
+                      unplaced pods are queued again.
+    """
+    import contextlib
+    import io
+    from scheduler import ClusterCache, FakeCoreV1Api, Scheduler
+
+    for workers, nodes, cores, job_seconds in scenarios:
+        server, url, bindings = run_fake_api_server(pods=pods)
+        configuration = client.Configuration()
+        configuration.host = url
+        configuration.connection_pool_maxsize = workers + 2
+        v1 = client.CoreV1Api(client.ApiClient(configuration))
+
+        cache = ClusterCache()
+        for node in FakeCoreV1Api(nodes=nodes, pods_per_node=0, cores=cores).list_node().items:
+            cache.on_node_event('ADDED', node)
+        pipeline = BindingPipeline(v1, Scheduler(cache), workers=workers, backoff=0.01, watch_timeout=1,
+                                   requeue_delay=0.05, max_requeue_delay=0.5)
+
+        def complete_jobs():
+            bound_at = {}
+            while not pipeline.stopped.wait(0.05):
+                now = time.perf_counter()
+                for uid in list(pipeline.bound):
+                    bound_at.setdefault(uid, now)
+                for uid, t in list(bound_at.items()):
+                    if now - t >= job_seconds:
+                        cache.forget(uid)
+                        del bound_at[uid]
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipeline.start()
+            if job_seconds:
+                threading.Thread(target=complete_jobs, daemon=True).start()
+            while sum(bindings.values()) < pods and time.perf_counter() - start < 60:
+                time.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            time.sleep(0.5)
+            pipeline.stop()
+            server.shutdown()
+
+        stats = pipeline.stats()
+        assert all(count == 1 for count in bindings.values()), "a pod was not bound exactly once"
+        assert stats['relists'] >= 1, "watch did not re-list after 410 Gone"
+        assert server.connections < pods, "bindings did not reuse pooled connections"
+        print(f"workers={workers:3}, {nodes:2} nodes x {cores} cores: {pods / elapsed:7.1f} bindings/s, "
+              f"retries={stats['retries']}, unschedulable={stats['unschedulable']}, requeued={stats['requeued']}, "
+              f"duplicates={stats['duplicates']}, relists={stats['relists']}, connections={server.connections}, "
+              f"p50={stats['bind_latency_p50'] * 1000:.1f} ms, p99={stats['bind_latency_p99'] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,126 @@
+import os
+import csv
+import time
+from datetime import datetime
+import instrumentation
+
+
+class EnergyIntegrator:
+    """
+    Integrate PDU power readings into energy using the time each reading was taken.
+
+    Consecutive samples are combined with the trapezoidal rule over their monotonic
+    timestamps, so jitter, slow replies and skipped ticks do not bias the result. Spans
+    longer than ``max_gap`` are still integrated but reported as gap time. Only the
+    running totals of the current interval are kept in memory; every ``interval``
+    seconds a compact record is appended to ``csv_file`` together with the PDU's own
+    cumulative Energy counter as a cross-check.
+    """
+
+    FIELDNAMES = ['timestamp', 'duration_s', 'samples', 'gap_s', 'mean_power_W', 'energy_Wh',
+                  'counter_energy_Wh', 'total_energy_Wh', 'total_counter_energy_Wh', 'drift_Wh']
+
+    def __init__(self, csv_file=None, interval=60, max_gap=5):
+        """
+        :param csv_file: Where to append per-interval records, None to keep no records.
+        :param interval: Length of a record in seconds.
+        :param max_gap: Spans between samples longer than this many seconds count as gaps.
+        """
+        self.csv_file = csv_file
+        self.interval = interval
+        self.max_gap = max_gap
+        self.energy_J = 0.0
+        self.last_t = None
+        self.last_power = None
+        self.first_counter = None
+        self.last_counter = None
+        self._start_interval(None)
+
+    def _start_interval(self, t):
+        self.interval_start = t
+        self.interval_timestamp = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+        self.interval_energy_J = 0.0
+        self.interval_samples = 0
+        self.interval_gap_s = 0.0
+        self.interval_first_counter = self.last_counter
+
+    @property
+    def energy_Wh(self):
+        return self.energy_J / 3600
+
+    @property
+    def drift_Wh(self):
+        """Integrated energy minus the energy counted by the PDU since the first sample."""
+        if self.first_counter is None:
+            return None
+        return self.energy_Wh - (self.last_counter - self.first_counter) * 1000
+
+    def update(self, power, t=None, counter=None):
+        """
+        Add a power sample.
+
+        :param power: Power reading in W, None if the PDU did not answer.
+        :param t: Monotonic timestamp of the reading (defaults to now).
+        :param counter: The PDU cumulative Energy reading in kWh, if available.
+        :return: The record written if this sample closed an interval, otherwise None.
+        """
+        if power is None:
+            return None
+        t = time.monotonic() if t is None else t
+        if counter is not None:
+            if self.first_counter is None:
+                self.first_counter = counter
+                self.interval_first_counter = counter
+            self.last_counter = counter
+
+        if self.last_t is None:
+            self.last_t, self.last_power = t, power
+            self._start_interval(t)
+            self.interval_samples = 1
+            return None
+
+        dt = t - self.last_t
+        if dt <= 0:
+            return None
+        if dt > self.max_gap:
+            self.interval_gap_s += dt
+        step_J = (power + self.last_power) / 2 * dt
+        self.energy_J += step_J
+        self.interval_energy_J += step_J
+        self.interval_samples += 1
+        self.last_t, self.last_power = t, power
+
+        if t - self.interval_start >= self.interval:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Close the current interval, append its record and start the next one."""
+        duration = self.last_t - self.interval_start
+        counter_energy = None
+        if self.last_counter is not None and self.interval_first_counter is not None:
+            counter_energy = round((self.last_counter - self.interval_first_counter) * 1000, 1)
+        drift = self.drift_Wh
+        record = {
+            'timestamp': self.interval_timestamp,
+            'duration_s': round(duration, 3),
+            'samples': self.interval_samples,
+            'gap_s': round(self.interval_gap_s, 3),
+            'mean_power_W': round(self.interval_energy_J / duration, 2) if duration > 0 else self.last_power,
+            'energy_Wh': round(self.interval_energy_J / 3600, 4),
+            'counter_energy_Wh': counter_energy,
+            'total_energy_Wh': round(self.energy_Wh, 4),
+            'total_counter_energy_Wh': None if drift is None else round(self.energy_Wh - drift, 1),
+            'drift_Wh': None if drift is None else round(drift, 4),
+        }
+        if self.csv_file:
+            with instrumentation.CSV_WRITE.time(os.path.basename(self.csv_file)):
+                file_exists = os.path.isfile(self.csv_file)
+                with open(self.csv_file, mode='a', newline='') as file:
+                    writer = csv.DictWriter(file, fieldnames=self.FIELDNAMES)
+                    if not file_exists:
+                        writer.writeheader()
+                    writer.writerow(record)
+        self._start_interval(self.last_t)
+        self.interval_samples = 1
+        return record
@@ -2,8 +2,10 @@ import os
 import time
 import schedule
 from dotenv import load_dotenv
-from pysnmp.hlapi import *
+from snmp_poller import SnmpPoller
+from energy_integrator import EnergyIntegrator
 from datetime import datetime
+import instrumentation
 
 # Load environment variables from ".env"
 load_dotenv()
@@ -13,6 +15,9 @@ COMMUNITY  = os.environ.get('COMMUNITY')
 PDU_IP     = os.environ.get('PDU_IP')
 POWER_OID  = os.environ.get('POWER_OID')
 ENERGY_OID = os.environ.get('ENERGY_OID')
+SNMP_TIMEOUT = float(os.environ.get('SNMP_TIMEOUT', 1))
+SNMP_RETRIES = int(os.environ.get('SNMP_RETRIES', 5))
+SAMPLE_INTERVAL = float(os.environ.get('SAMPLE_INTERVAL', 1))
 
 # Define the OID to description mapping
 OID_TO_DESCRIPTION = {
@@ -20,53 +25,26 @@ OID_TO_DESCRIPTION = {
     ENERGY_OID: 'Energy'
 }
 
-energy_W_min = 0
+# One engine for the lifetime of the process, Power and Energy are read in a single GET
+pdu = SnmpPoller([PDU_IP], COMMUNITY, OID_TO_DESCRIPTION, timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES)
 
-def snmp_get(target, community, oid, port=161):
-    """
-    Perform an SNMP GET operation.
+# Integrate on the time each reading was taken, records are written once a minute
+integrator = EnergyIntegrator('monitor_results/energy_intervals.csv', interval=60, max_gap=5 * SAMPLE_INTERVAL)
 
-    :param target: The target device IP address or hostname.
-    :param community: The SNMP community string.
-    :param oid: The OID to query.
-    :param port: The SNMP port number (default is 161).
-    :return: The result of the SNMP GET operation.
-    """
-    iterator = getCmd(
-        SnmpEngine(),
-        CommunityData(community, mpModel=0),  # mpModel=0 means SNMPv1, for SNMPv2 use mpModel=1
-        UdpTransportTarget((target, port)),
-        ContextData(),
-        ObjectType(ObjectIdentity(oid))
-    )
-
-    error_indication, error_status, error_index, var_binds = next(iterator)
-
-    if error_indication:
-        print(f"Error: {error_indication}")
-        return None
-    elif error_status:
-        print(f"Error: {error_status.prettyPrint()} at {error_index and var_binds[int(error_index) - 1][0] or '?'}")
-        return None
-    else:
-        result = {}
-        for var_bind in var_binds:
-            oid_str = str(var_bind[0])
-            description = OID_TO_DESCRIPTION[oid_str]
-            result[description] = int(var_bind[1].prettyPrint())
-            if description == 'Power':  result[description] *= 10
-            if description == 'Energy': result[description] /= 10
-        return result
-    
 def power_monitor():
-    global energy_W_min
-    power_pdu = snmp_get(PDU_IP, COMMUNITY, POWER_OID)
-    energy_W_min += power_pdu['Power'] / 60
-    print(datetime.now().strftime('%Y/%m/%d %H:%M:%S'),'\t',power_pdu['Power'],'\t', round(energy_W_min,2))
-
-# Schedule the job every second
-schedule.every(1).second.do(power_monitor)
-power_monitor()
+    power_pdu = pdu.poll()[PDU_IP]
+    if power_pdu is None:
+        return
+    integrator.update(power_pdu['Power'], time.monotonic(), power_pdu.get('Energy'))
+    energy_W_min = integrator.energy_J / 60
+    if instrumentation.VERBOSE:
+        print(datetime.now().strftime('%Y/%m/%d %H:%M:%S'),'\t',power_pdu['Power'],'\t', round(energy_W_min,2))
+
+# Schedule the job every SAMPLE_INTERVAL seconds (1 s by default), recording how late each tick starts
+instrumentation.start_from_env()
+tick = instrumentation.TickTracker('power_1s', SAMPLE_INTERVAL)(power_monitor)
+schedule.every(SAMPLE_INTERVAL).seconds.do(tick)
+tick()
 while True:
     schedule.run_pending()
-    time.sleep(1)
+    time.sleep(max(schedule.idle_seconds(), 0))
@@ -0,0 +1,338 @@
+import os
+import sys
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from dotenv import load_dotenv
+
+# Load environment variables from ".env"
+load_dotenv()
+# VERBOSE=0 silences the per-tick and per-pod console reports, errors are still printed
+VERBOSE = os.environ.get('VERBOSE', '1') != '0'
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DRIFT_BUCKETS = (-1.0, -0.1, -0.01, 0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """A monotonically increasing count per label combination."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram per label combination, as Prometheus expects it.
+
+    ``observe`` is a binary search and two additions under a lock, cheap enough for
+    every query, SNMP call and binding.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (last one is +Inf), sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    """The metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help, labelnames, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+
+TICK_DRIFT = histogram('tick_drift_seconds', 'Start of a scheduled tick minus its planned start.', ['schedule'],
+                       buckets=DRIFT_BUCKETS)
+TICK_DURATION = histogram('tick_duration_seconds', 'Run time of a scheduled tick.', ['schedule'])
+CSV_WRITE = histogram('csv_write_seconds', 'Time to append one row to a results CSV.', ['file'])
+
+
+class TickTracker:
+    """
+    Record drift and run time of a job that should start every ``interval`` seconds.
+
+    Drift is the start of a tick minus the start of the previous one plus ``interval``,
+    so a late tick shows as positive and a tick that runs early as negative.
+    """
+
+    def __init__(self, schedule_name, interval):
+        self.labels = (schedule_name,)
+        self.interval = interval
+        self.last = None
+
+    def __call__(self, job):
+        def tracked(*args, **kwargs):
+            start = time.monotonic()
+            if self.last is not None:
+                TICK_DRIFT.observe(start - self.last - self.interval, *self.labels)
+            self.last = start
+            try:
+                return job(*args, **kwargs)
+            finally:
+                TICK_DURATION.observe(time.monotonic() - start, *self.labels)
+        tracked.__name__ = job.__name__
+        return tracked
+
+
+class SamplingProfiler:
+    """
+    Sample the stacks of all threads every ``interval`` seconds from a daemon thread.
+
+    Stacks are counted in the collapsed ``frame;frame;frame count`` format that
+    flamegraph tools read. Nothing runs in the sampled threads themselves, so the cost is
+    one ``sys._current_frames`` walk per interval.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = StackCounter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+profiler = None
+# The /metrics server of this process, started once by start_from_env
+server = None
+_start_lock = threading.Lock()
+
+
+def serve(port, registry=REGISTRY, host='0.0.0.0'):
+    """
+    Serve ``/metrics`` (and ``/profile`` while the profiler runs) on a daemon thread.
+
+    :return: The HTTP server, its ``server_address`` holds the bound port.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = registry.render().encode()
+            elif self.path == '/profile' and profiler is not None:
+                body = profiler.collapsed().encode()
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+def start_from_env():
+    """
+    Start the ``/metrics`` endpoint if ``METRICS_PORT`` is set and the profiler if ``PROFILE_INTERVAL`` is.
+
+    Safe to call from every entry point of a process (``kube_api`` also runs
+    ``monitoring.run``), each is started only once.
+    """
+    global profiler, server
+    with _start_lock:
+        if PROFILE_INTERVAL and profiler is None:
+            profiler = SamplingProfiler(PROFILE_INTERVAL).start()
+        if METRICS_PORT and server is None:
+            try:
+                server = serve(METRICS_PORT)
+            except OSError as e:
+                print(f"Error: metrics endpoint on port {METRICS_PORT}: {e}")
+
+
+def benchmark(rounds=200000):
+    """
+    Time each instrumentation call and the ``/metrics`` render, and the profiler's cost on a busy loop.
+    """
+    registry = Registry()
+    count = registry.counter('benchmark_total', 'Benchmark counter.', ['target'])
+    latency = registry.histogram('benchmark_seconds', 'Benchmark histogram.', ['query'])
+
+    def per_call(fn):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        return (time.perf_counter() - start) / rounds
+
+    baseline = per_call(lambda: None)
+    inc = per_call(lambda: count.inc('pdu')) - baseline
+    observe = per_call(lambda: latency.observe(0.042, 'cpu_usage_percentage')) - baseline
+
+    def timed():
+        with latency.time('cpu_usage_percentage'):
+            pass
+    timer = per_call(timed) - baseline
+
+    for i in range(50):
+        latency.observe(0.01 * i, f'query_{i % 5}')
+    start = time.perf_counter()
+    for _ in range(100):
+        text = registry.render()
+    render = (time.perf_counter() - start) / 100
+
+    # One monitor tick makes ~5 query observations, 1 SNMP, 1 CSV write and 2 tick observations
+    per_tick = 8 * observe + 2 * timer
+    print(f"Counter.inc           : {inc * 1e9:.0f} ns")
+    print(f"Histogram.observe     : {observe * 1e9:.0f} ns")
+    print(f"Histogram.time block  : {timer * 1e9:.0f} ns")
+    print(f"Render /metrics       : {render * 1e6:.0f} us for {len(text.splitlines())} lines")
+    print(f"Per 15 s monitor tick : {per_tick * 1e6:.1f} us ({per_tick / 15 * 100:.6f}% of the interval)")
+
+    def work():
+        total = 0
+        for i in range(3000000):
+            total += i
+        return total
+
+    start = time.perf_counter()
+    work()
+    plain = time.perf_counter() - start
+    sampler = SamplingProfiler(0.01).start()
+    start = time.perf_counter()
+    work()
+    profiled = time.perf_counter() - start
+    sampler.stop()
+    print(f"Profiler at 100 Hz    : {(profiled / plain - 1) * 100:+.1f}% on a busy loop, "
+          f"{sum(sampler.stacks.values())} samples")
+
+
+if __name__ == '__main__':
+    benchmark()
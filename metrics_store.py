@@ -0,0 +1,165 @@
+import math
+import threading
+from array import array
+from collections import deque
+
+CLUSTER = 'cluster'
+NODE_METRICS = ['node_status', 'cpu_usage_percentage', 'cpu_reserve', 'mem_usage_percentage', 'mem_reserve',
+                'gpu_usage_percentage', 'gpu_temperature']
+CLUSTER_METRICS = ['Power', 'Energy']
+
+
+class RollingSeries:
+    """
+    Fixed-size ring buffer of one metric with incrementally maintained aggregates.
+
+    Mean and max cover the samples currently in the buffer, the EWMA covers all samples
+    ever added. Every read is O(1), every append is amortized O(1).
+    """
+
+    def __init__(self, capacity, alpha):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.values = array('d', [math.nan] * capacity)
+        self.times = array('d', [math.nan] * capacity)
+        self.count = 0
+        self.total = 0
+        self.sum = 0.0
+        self.ewma = math.nan
+        # Monotonically decreasing (sequence, value) pairs, the head is the window max
+        self._max = deque()
+
+    def append(self, t, value):
+        index = self.total % self.capacity
+        if self.count == self.capacity:
+            self.sum -= self.values[index]
+        else:
+            self.count += 1
+        self.values[index] = value
+        self.times[index] = t
+        self.sum += value
+        # Re-sum once per lap so float rounding does not accumulate
+        if index == self.capacity - 1:
+            self.sum = math.fsum(self.values)
+
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((self.total, value))
+        if self._max[0][0] <= self.total - self.capacity:
+            self._max.popleft()
+        self.total += 1
+
+        self.ewma = value if math.isnan(self.ewma) else self.alpha * value + (1 - self.alpha) * self.ewma
+
+    @property
+    def latest(self):
+        return self.values[(self.total - 1) % self.capacity] if self.count else math.nan
+
+    @property
+    def latest_time(self):
+        return self.times[(self.total - 1) % self.capacity] if self.count else math.nan
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+    @property
+    def max(self):
+        return self._max[0][1] if self._max else math.nan
+
+    def window(self):
+        """Return ``(times, values)`` of the buffered samples, oldest first."""
+        start = self.total % self.capacity if self.count == self.capacity else 0
+        order = [(start + i) % self.capacity for i in range(self.count)]
+        return [self.times[i] for i in order], [self.values[i] for i in order]
+
+
+class MetricsStore:
+    """
+    Embedded store of recent cluster metrics, fed by ``monitor_cluster`` on every tick.
+
+    Each node and metric gets a ``RollingSeries`` of ``capacity`` samples, so memory
+    stays bounded no matter how long the monitor runs. Cluster-wide readings (Power,
+    Energy) are stored under the node name ``CLUSTER``. Readers query the store
+    directly instead of going back to Prometheus; every read and write holds ``lock``, so
+    readers on other threads never see a series halfway through an append.
+    """
+
+    def __init__(self, capacity=240, alpha=0.2):
+        """
+        :param capacity: Samples kept per node and metric (240 is one hour at 15 s).
+        :param alpha: EWMA smoothing factor.
+        """
+        self.capacity = capacity
+        self.alpha = alpha
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def _series(self, node, metric):
+        key = (node, metric)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = RollingSeries(self.capacity, self.alpha)
+        return series
+
+    def add(self, node, metric, value, t):
+        with self.lock:
+            self._series(node, metric).append(t, float(value))
+
+    def update(self, monitor_result, t):
+        """
+        Add one ``monitor_cluster`` result.
+
+        :param monitor_result: The dict built by ``monitor_cluster``.
+        :param t: Timestamp of the tick in seconds.
+        """
+        with self.lock:
+            for metric in NODE_METRICS:
+                for node, value in monitor_result.get(metric, {}).items():
+                    self._series(node, metric).append(t, float(value))
+            for metric in CLUSTER_METRICS:
+                if metric in monitor_result:
+                    self._series(CLUSTER, metric).append(t, float(monitor_result[metric]))
+
+    def _get(self, node, metric, attribute):
+        with self.lock:
+            series = self.series.get((node, metric))
+            return getattr(series, attribute) if series is not None else math.nan
+
+    def latest(self, node, metric):
+        return self._get(node, metric, 'latest')
+
+    def mean(self, node, metric):
+        return self._get(node, metric, 'mean')
+
+    def max(self, node, metric):
+        return self._get(node, metric, 'max')
+
+    def ewma(self, node, metric):
+        return self._get(node, metric, 'ewma')
+
+    def age(self, node, metric, now):
+        """Seconds since the latest sample of a node and metric."""
+        return now - self._get(node, metric, 'latest_time')
+
+    def window(self, node, metric):
+        """Return ``(times, values)`` of a node and metric, oldest first."""
+        with self.lock:
+            series = self.series.get((node, metric))
+            return series.window() if series is not None else ([], [])
+
+    def nodes(self):
+        with self.lock:
+            return sorted({node for node, _ in self.series if node != CLUSTER})
+
+    def snapshot(self, metric, aggregate='latest'):
+        """
+        Read one aggregate of a metric for every node.
+
+        :param metric: The metric name, e.g. ``cpu_usage_percentage``.
+        :param aggregate: One of ``latest``, ``mean``, ``max`` or ``ewma``.
+        :return: Mapping of node to value.
+        """
+        with self.lock:
+            return {node: getattr(series, aggregate) for (node, name), series in self.series.items()
+                    if name == metric}
@@ -0,0 +1,285 @@
+import os
+import csv
+import glob
+import gzip
+import shutil
+from datetime import datetime
+import instrumentation
+
+TIMESTAMP_FORMAT = '%Y/%m/%d %H:%M:%S'
+SCALAR_COLUMNS = ['Power', 'Energy']
+NODE_METRICS = ['node_status', 'cpu_usage_percentage', 'cpu_reserve', 'mem_usage_percentage', 'mem_reserve',
+                'gpu_usage_percentage', 'gpu_temperature']
+
+
+def flatten(monitor_result):
+    """
+    Turn a ``monitor_cluster`` result into one wide row with a column per node and metric.
+
+    Per-node dicts become ``<metric>_<node>`` columns (``node_status`` as 0/1), the node list
+    is implied by the ``node_status_<node>`` columns and dropped.
+
+    :param monitor_result: The dict returned by ``monitor_cluster``.
+    :return: Mapping of column name to value.
+    """
+    row = {'timestamp': monitor_result['timestamp']}
+    for key in SCALAR_COLUMNS:
+        if key in monitor_result:
+            row[key] = monitor_result[key]
+    for metric in NODE_METRICS:
+        for node, value in sorted(monitor_result.get(metric, {}).items()):
+            row[f'{metric}_{node}'] = int(value) if metric == 'node_status' else value
+    return row
+
+
+class MonitorWriter:
+    """
+    Append wide monitor rows to rolling CSV segments.
+
+    Segments live in ``directory`` and are named after the hour of their first row. A
+    segment is closed when the hour changes, when it grows past ``max_bytes``, or when a
+    row brings a column the segment header does not have (a node joined the cluster), so
+    every segment has one fixed layout. Closed segments are gzip-compressed. Rows are
+    written through a kept-open file and flushed every ``flush_rows`` rows.
+    """
+
+    def __init__(self, directory, segment_seconds=3600, max_bytes=64 * 1024 * 1024, flush_rows=1, compress=True):
+        """
+        :param directory: Where segments are written.
+        :param segment_seconds: Start a new segment every this many seconds, None to roll by size only.
+        :param max_bytes: Start a new segment once the open one is this large.
+        :param flush_rows: Flush buffered rows to disk every this many rows. The default
+                           flushes every row, so a killed monitor loses nothing; bulk
+                           writers such as ``convert`` batch more.
+        :param compress: Gzip segments once they are closed.
+        """
+        self.directory = directory
+        self.name = os.path.basename(os.path.normpath(directory))
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.flush_rows = flush_rows
+        self.compress = compress
+        self.file = None
+        self.writer = None
+        self.columns = None
+        self.segment_key = None
+        self.pending_rows = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_key(self, timestamp):
+        if self.segment_seconds is None:
+            return None
+        epoch = datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+        return int(epoch // self.segment_seconds)
+
+    def _open(self, row):
+        stamp = datetime.strptime(row['timestamp'], TIMESTAMP_FORMAT).strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(self.directory, f'{stamp}.csv')
+        suffix = 1
+        while os.path.exists(path) or os.path.exists(path + '.gz'):
+            path = os.path.join(self.directory, f'{stamp}-{suffix}.csv')
+            suffix += 1
+        self.columns = list(row.keys())
+        self.file = open(path, mode='w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.columns)
+        self.writer.writeheader()
+        self.segment_key = self._segment_key(row['timestamp'])
+
+    def write(self, row):
+        """
+        Append one flattened row.
+
+        :param row: A row as returned by ``flatten``.
+        """
+        with instrumentation.CSV_WRITE.time(self.name):
+            self._write(row)
+
+    def _write(self, row):
+        if self.file is not None and (
+                self._segment_key(row['timestamp']) != self.segment_key
+                or not row.keys() <= set(self.columns)
+                or self.file.tell() >= self.max_bytes):
+            self.close()
+        if self.file is None:
+            self._open(row)
+        self.writer.writerow(row)
+        self.pending_rows += 1
+        if self.pending_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+        self.pending_rows = 0
+
+    def close(self):
+        """Close the open segment and compress it."""
+        if self.file is None:
+            return
+        path = self.file.name
+        self.file.close()
+        self.file = None
+        self.writer = None
+        self.pending_rows = 0
+        if self.compress:
+            with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(path)
+
+
+def segment_paths(directory):
+    """Return the segments of ``directory`` in write order."""
+    return sorted(glob.glob(os.path.join(directory, '*.csv')) + glob.glob(os.path.join(directory, '*.csv.gz')),
+                  key=lambda path: os.path.basename(path).split('.')[0])
+
+
+def load(directory):
+    """
+    Load all segments of ``directory`` into one pandas DataFrame.
+
+    Segments with different node sets are aligned on column name, missing values are NaN.
+
+    :param directory: A directory written by ``MonitorWriter``.
+    :return: A DataFrame with a parsed ``timestamp`` column and one numeric column per node and metric.
+    """
+    import pandas as pd
+
+    frames = [pd.read_csv(path) for path in segment_paths(directory)]
+    df = pd.concat(frames, ignore_index=True, sort=False)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], format=TIMESTAMP_FORMAT)
+    return df
+
+
+def load_arrays(directory):
+    """
+    Load all segments of ``directory`` as NumPy arrays.
+
+    :return: Mapping of column name to array, ``timestamp`` as ``datetime64``.
+    """
+    df = load(directory)
+    return {column: df[column].to_numpy() for column in df.columns}
+
+
+def node_columns(df, metric):
+    """
+    Select the per-node columns of one metric.
+
+    :return: The columns renamed to node names, e.g. ``cpu_usage_percentage_cillium1`` as ``cillium1``.
+    """
+    prefix = f'{metric}_'
+    columns = [column for column in df.columns if column.startswith(prefix)]
+    return df[columns].rename(columns=lambda column: column[len(prefix):])
+
+
+def convert(csv_file, directory):
+    """
+    Convert a CSV written by the old ``monitor_cluster`` (dict cells) into segments.
+
+    :param csv_file: The legacy CSV file.
+    :param directory: Output directory for the segments, must not hold segments yet.
+    :return: Number of rows converted.
+    :raises FileExistsError: If ``directory`` already holds segments, converting again
+                             would add a second copy of every row.
+    """
+    from ast import literal_eval
+
+    if os.path.isdir(directory) and segment_paths(directory):
+        raise FileExistsError(f"{directory} already holds segments")
+    writer = MonitorWriter(directory, segment_seconds=None, flush_rows=1024)
+    rows = 0
+    with open(csv_file, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        for values in reader:
+            record = dict(zip(header, values))
+            monitor_result = {'timestamp': record['timestamp']}
+            for key in SCALAR_COLUMNS:
+                if record.get(key):
+                    monitor_result[key] = float(record[key]) if '.' in record[key] else int(record[key])
+            for metric in NODE_METRICS:
+                if record.get(metric):
+                    monitor_result[metric] = literal_eval(record[metric])
+            writer.write(flatten(monitor_result))
+            rows += 1
+    writer.close()
+    return rows
+
+
+def is_legacy(csv_file):
+    with open(csv_file, newline='') as file:
+        return 'node_status' in next(csv.reader(file), [])
+
+
+def convert_all(paths, output_directory):
+    """
+    Convert every legacy monitor CSV in ``paths``, other CSVs are skipped.
+
+    Each file ``<name>.csv`` is written to ``<output_directory>/<name>/``, files whose
+    directory already holds segments are skipped.
+    """
+    for path in paths:
+        if not is_legacy(path):
+            print(f"Skipping {path}: not a monitor_cluster CSV")
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            rows = convert(path, os.path.join(output_directory, name))
+        except FileExistsError as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        print(f"Converted {path}: {rows} rows")
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(path) for path in segment_paths(directory))
+
+
+def benchmark(paths, output_directory, rounds=3):
+    """
+    Compare load time and size of legacy CSVs against their converted segments.
+
+    The legacy path is the one used in ``tmp/LR-power-prediction.ipynb``: ``read_csv``
+    then ``eval`` on every dict cell, then expand the dicts into per-node columns.
+    """
+    import time
+    import pandas as pd
+
+    legacy_time = converted_time = legacy_size = converted_size = 0
+    for path in paths:
+        if not is_legacy(path):
+            continue
+        directory = os.path.join(output_directory, os.path.splitext(os.path.basename(path))[0])
+        if not os.path.isdir(directory):
+            convert(path, directory)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            df = pd.read_csv(path)
+            for metric in NODE_METRICS:
+                if metric in df.columns:
+                    df = pd.concat([df, df[metric].apply(eval).apply(pd.Series).add_prefix(f'{metric}_')], axis=1)
+        legacy_time += (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            load(directory)
+        converted_time += (time.perf_counter() - start) / rounds
+
+        legacy_size += os.path.getsize(path)
+        converted_size += directory_size(directory)
+
+    print(f"Legacy load    : {legacy_time:.3f} s, {legacy_size / 1024:.0f} KiB")
+    print(f"Segment load   : {converted_time:.3f} s, {converted_size / 1024:.0f} KiB")
+    print(f"Speed-up       : {legacy_time / converted_time:.1f}x, size ratio {converted_size / legacy_size:.3f}")
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 4 or sys.argv[1] not in ('convert', 'benchmark'):
+        print("Usage: python monitor_store.py convert|benchmark OUTPUT_DIR CSV_FILE...")
+        sys.exit(1)
+    if sys.argv[1] == 'convert':
+        convert_all(sys.argv[3:], sys.argv[2])
+    else:
+        benchmark(sys.argv[3:], sys.argv[2])
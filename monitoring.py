@@ -1,20 +1,29 @@
 import os
-import requests
+import sys
+import atexit
+import signal
 import schedule
 import time
-import csv
 from datetime import datetime
 from dotenv import load_dotenv
-from pysnmp.hlapi import *
+from prometheus_collector import PrometheusCollector
+from snmp_poller import SnmpPoller
+from monitor_store import MonitorWriter, flatten
+from metrics_store import MetricsStore
+from power_model import PowerModel
+import instrumentation
 
 # Load environment variables from ".env"
 load_dotenv()
 PROMETHEUS_URL = os.environ.get('PROMETHEUS_URL')
+PROMETHEUS_DEADLINE = float(os.environ.get('PROMETHEUS_DEADLINE', 10))
 # Replace with your SNMP agent details
 COMMUNITY  = os.environ.get('COMMUNITY')
 PDU_IP     = os.environ.get('PDU_IP')
 POWER_OID  = os.environ.get('POWER_OID')
 ENERGY_OID = os.environ.get('ENERGY_OID')
+SNMP_TIMEOUT = float(os.environ.get('SNMP_TIMEOUT', 1))
+SNMP_RETRIES = int(os.environ.get('SNMP_RETRIES', 5))
 
 # Define the OID to description mapping
 OID_TO_DESCRIPTION = {
@@ -22,50 +31,80 @@ OID_TO_DESCRIPTION = {
     ENERGY_OID: 'Energy'
 }
 
+# One engine for the lifetime of the process, Power and Energy are read in a single GET
+pdu = SnmpPoller([PDU_IP], COMMUNITY, OID_TO_DESCRIPTION, timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES)
+
+PROMETHEUS_QUERIES = {
+    'cluster_node_list':    'kube_node_info',
+    'cpu_usage_percentage': '100 - (avg by (node) (rate(node_cpu_seconds_total{mode="idle"}[1m])) * 100)',
+    'cpu_reserve':          'sum by (node) (kube_pod_container_resource_requests{resource="cpu"})',
+    'mem_usage_percentage': '100 - ((node_memory_MemAvailable_bytes / node_memory_MemTotal_bytes) * 100)',
+    'mem_reserve':          'sum by (node) (kube_pod_container_resource_requests{resource="memory"}) / 1e9',
+}
+
+# All queries of a tick must finish well inside the 15 s schedule interval
+prometheus = PrometheusCollector(PROMETHEUS_URL, deadline=PROMETHEUS_DEADLINE)
+
+monitor_writer = MonitorWriter('monitor_results/monitor_results_15s')
+# Close (and compress) the open segment when the process exits
+atexit.register(monitor_writer.close)
+
+# Recent samples for in-process readers (scheduler, node controller), one hour at 15 s
+metrics = MetricsStore(capacity=240)
+
+# Cluster power model, refined on every tick once the node list is known
+power_model = None
+
 def prometheus_get(debug=False):
     prometheus_result = dict()
+    responses = prometheus.collect(PROMETHEUS_QUERIES)
+    # Queries that failed or missed the deadline are left out of the result instead of
+    # being recorded as empty, and listed under 'failed_queries'
+    failed = sorted(prometheus.last_errors)
+    prometheus_result['failed_queries'] = failed
+
     # Query Nodes
-    node_response = requests.get(PROMETHEUS_URL, params={'query': 'kube_node_info'}).json()
-    node_list     = [node['metric']['node'] for node in node_response['data']['result']]
-    prometheus_result['cluster_node_list'] = node_list
+    node_list = [node['metric']['node'] for node in responses.get('cluster_node_list', [])]
+    if 'cluster_node_list' not in failed:
+        prometheus_result['cluster_node_list'] = node_list
 
     # Query CPU Utilization
-    cpu_usage_percentage = '100 - (avg by (node) (rate(node_cpu_seconds_total{mode="idle"}[1m])) * 100)'
-    cpu_usage_percentage_response = requests.get(PROMETHEUS_URL, params={'query': cpu_usage_percentage}).json()
-    cpu_usage_percentage_json = {result['metric']['node']: round(float(result['value'][1]),2) for result in cpu_usage_percentage_response['data']['result']}
-    prometheus_result['cpu_usage_percentage'] = cpu_usage_percentage_json
+    cpu_usage_percentage_json = {result['metric']['node']: round(float(result['value'][1]),2) for result in responses.get('cpu_usage_percentage', [])}
+    if 'cpu_usage_percentage' not in failed:
+        prometheus_result['cpu_usage_percentage'] = cpu_usage_percentage_json
 
+    # A node is on when it reports CPU usage, which is only known when both queries answered
     active_node_list = list(cpu_usage_percentage_json.keys())
     active_node_json = {node:0 for node in active_node_list}
-    node_status = {node: True if node in active_node_list else False for node in node_list}
-    prometheus_result['node_status'] = node_status
+    if 'cluster_node_list' not in failed and 'cpu_usage_percentage' not in failed:
+        node_status = {node: True if node in active_node_list else False for node in node_list}
+        prometheus_result['node_status'] = node_status
 
-    cpu_reserve = 'sum by (node) (kube_pod_container_resource_requests{resource="cpu"})'
-    cpu_reserve_response = requests.get(PROMETHEUS_URL, params={'query': cpu_reserve}).json()
     cpu_reserve_json = active_node_json.copy()
-    for result in cpu_reserve_response['data']['result']:
+    for result in responses.get('cpu_reserve', []):
         if len(result['metric']) > 0:
             node = result['metric']['node']
             value = round(float(result['value'][1]), 2)
             cpu_reserve_json[node] = value
-    prometheus_result['cpu_reserve'] = cpu_reserve_json
+    if 'cpu_reserve' not in failed:
+        prometheus_result['cpu_reserve'] = cpu_reserve_json
 
     # Query Memory Utilization
-    mem_usage_percentage = '100 - ((node_memory_MemAvailable_bytes / node_memory_MemTotal_bytes) * 100)'
-    mem_usage_percentage_response = requests.get(PROMETHEUS_URL, params={'query': mem_usage_percentage}).json()
-    mem_usage_percentage_json = {result['metric']['node']: round(float(result['value'][1]),2) for result in mem_usage_percentage_response['data']['result']}
-    prometheus_result['mem_usage_percentage'] = mem_usage_percentage_json
+    mem_usage_percentage_json = {result['metric']['node']: round(float(result['value'][1]),2) for result in responses.get('mem_usage_percentage', [])}
+    if 'mem_usage_percentage' not in failed:
+        prometheus_result['mem_usage_percentage'] = mem_usage_percentage_json
 
-    mem_reserve = 'sum by (node) (kube_pod_container_resource_requests{resource="memory"}) / 1e9'
-    mem_reserve_response = requests.get(PROMETHEUS_URL, params={'query': mem_reserve}).json()
     mem_reserve_json = active_node_json.copy()
-    for result in mem_reserve_response['data']['result']:
+    for result in responses.get('mem_reserve', []):
         if len(result['metric']) > 0:
             node = result['metric']['node']
             value = round(float(result['value'][1]), 2)
             mem_reserve_json[node] = value
+    if 'mem_reserve' not in failed:
+        prometheus_result['mem_reserve'] = mem_reserve_json
 
-    prometheus_result['mem_reserve'] = mem_reserve_json
+    for name, error in prometheus.last_errors.items():
+        print(f"Error: query {name} failed: {error}")
 
     # Print Result
     if debug:
@@ -81,72 +120,32 @@ def prometheus_get(debug=False):
         print("Memory Reservation (GiB):")
         print(mem_reserve_json)
         print("===========================")
+        print("Query Latency (s):")
+        print({name: round(latency, 3) for name, latency in prometheus.last_latency.items()})
+        print("===========================")
 
     return prometheus_result
 
-def snmp_get(target, community, oid, port=161):
-    """
-    Perform an SNMP GET operation.
-
-    :param target: The target device IP address or hostname.
-    :param community: The SNMP community string.
-    :param oid: The OID to query.
-    :param port: The SNMP port number (default is 161).
-    :return: The result of the SNMP GET operation.
-    """
-    iterator = getCmd(
-        SnmpEngine(),
-        CommunityData(community, mpModel=0),  # mpModel=0 means SNMPv1, for SNMPv2 use mpModel=1
-        UdpTransportTarget((target, port)),
-        ContextData(),
-        ObjectType(ObjectIdentity(oid))
-    )
-
-    error_indication, error_status, error_index, var_binds = next(iterator)
-
-    if error_indication:
-        print(f"Error: {error_indication}")
-        return None
-    elif error_status:
-        print(f"Error: {error_status.prettyPrint()} at {error_index and var_binds[int(error_index) - 1][0] or '?'}")
-        return None
-    else:
-        result = {}
-        for var_bind in var_binds:
-            oid_str = str(var_bind[0])
-            description = OID_TO_DESCRIPTION[oid_str]
-            result[description] = int(var_bind[1].prettyPrint())
-            if description == 'Power':  result[description] *= 10
-            if description == 'Energy': result[description] /= 10
-        return result
-
 def delete_completed_task():
     time_completed_task = 'kube_pod_completion_time - kube_pod_start_time'
-    time_completed_task_response = requests.get(PROMETHEUS_URL, params={'query': time_completed_task}).json()
-    print(time_completed_task_response['data']['result'][0]['metric']['pod'])
+    time_completed_task_response = prometheus.query(time_completed_task)
+    print(time_completed_task_response[0]['metric']['pod'])
 
 def monitor_cluster(report=True):
     timestamp = datetime.now().strftime('%Y/%m/%d %H:%M:%S')
     prometheus_result = prometheus_get()
-    power_pdu = snmp_get(PDU_IP, COMMUNITY, POWER_OID)
-    energy_pdu = snmp_get(PDU_IP, COMMUNITY, ENERGY_OID)
-    monitor_result = {'timestamp':timestamp, **prometheus_result, **power_pdu, **energy_pdu}
-
-    # Define CSV file path
-    csv_file = 'monitor_results/monitor_results_15s.csv'
-
-    # Check if the CSV file exists to write header only once
-    file_exists = os.path.isfile(csv_file)
-
-    # Write data to CSV file
-    with open(csv_file, mode='a', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=monitor_result.keys())
-
-        if not file_exists:
-            writer.writeheader()  # Write header only once if file doesn't exist
-
-        writer.writerow(monitor_result)
-    if report:
+    pdu_result = pdu.poll()[PDU_IP] or {}
+    monitor_result = {'timestamp':timestamp, **prometheus_result, **pdu_result}
+    metrics.update(monitor_result, time.time())
+    global power_model
+    if power_model is None and monitor_result.get('node_status'):
+        power_model = PowerModel(sorted(monitor_result['node_status']))
+    if power_model is not None:
+        power_model.update_from_monitor(monitor_result)
+
+    # Append one wide row per tick, segments roll over hourly and are compressed when closed
+    monitor_writer.write(flatten(monitor_result))
+    if report and instrumentation.VERBOSE:
         # Determine the maximum key length for alignment
         max_key_length = max(len(key) for key in monitor_result.keys())
 
@@ -157,9 +156,17 @@ def monitor_cluster(report=True):
     #delete_completed_task()
     return monitor_result
 
-# Schedule the job every minute
-schedule.every(15).seconds.do(monitor_cluster)
-monitor_cluster()
-while True:
-    schedule.run_pending()
-    time.sleep(1)
+def run():
+    instrumentation.start_from_env()
+    # Schedule the job every 15 seconds, recording how late each tick starts
+    tick = instrumentation.TickTracker('monitor_15s', 15)(monitor_cluster)
+    schedule.every(15).seconds.do(tick)
+    tick()
+    while True:
+        schedule.run_pending()
+        time.sleep(1)
+
+if __name__ == "__main__":
+    # "docker stop" sends SIGTERM, exit through atexit so the last segment is closed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    run()
@@ -0,0 +1,325 @@
+import itertools
+import numpy as np
+
+
+def active_node_sets(n):
+    """Return every on/off combination of ``n`` nodes as a ``(2**n, n)`` bool array."""
+    return np.array(list(itertools.product([False, True], repeat=n)), dtype=bool)
+
+
+class PowerModel:
+    """
+    Linear cluster power model updated online with recursive least squares.
+
+    Cluster power is modelled as a constant plus, for every node, an idle draw while the
+    node is on and a slope over its CPU, memory and GPU usage (and optionally its squared CPU
+    usage, for the curvature seen in ``tmp/LR-power-prediction.ipynb``). Predictions are
+    one matrix product over a whole batch of candidate states; ``update`` folds in one
+    measured sample at a time, with ``forgetting`` discounting old samples so the
+    coefficients follow slow drift. Forgetting pauses while the covariance is above its
+    initial size, which keeps directions the data does not excite (a node that never
+    turns off) from winding up and blowing the coefficients away.
+    """
+
+    def __init__(self, nodes, quadratic=True, forgetting=0.999, delta=1e-3):
+        """
+        :param nodes: Node names, fixing the column order of all per-node arrays.
+        :param quadratic: Add a squared CPU term per node.
+        :param forgetting: RLS forgetting factor, 1 keeps all history.
+        :param delta: Initial inverse covariance scale, small values trust the first samples more.
+        """
+        self.nodes = list(nodes)
+        self.quadratic = quadratic
+        self.forgetting = forgetting
+        self.n_features = 1 + len(self.nodes) * (5 if quadratic else 4)
+        self.weights = np.zeros(self.n_features)
+        self.P = np.eye(self.n_features) / delta
+        self.max_trace = self.n_features / delta
+        self.samples = 0
+
+    def features(self, active, cpu, mem, gpu=None):
+        """
+        Build the feature matrix of a batch of cluster states.
+
+        :param active: ``(batch, nodes)`` on/off flags.
+        :param cpu: ``(batch, nodes)`` CPU usage in percent, ignored where the node is off.
+        :param mem: ``(batch, nodes)`` memory usage in percent, ignored where the node is off.
+        :param gpu: ``(batch, nodes)`` GPU usage in percent, NaN or omitted for nodes without a GPU.
+        :return: ``(batch, n_features)`` array.
+        """
+        active = np.atleast_2d(np.asarray(active, dtype=float))
+        cpu = np.nan_to_num(np.atleast_2d(np.asarray(cpu, dtype=float))) * active
+        mem = np.nan_to_num(np.atleast_2d(np.asarray(mem, dtype=float))) * active
+        gpu = np.zeros_like(cpu) if gpu is None else np.nan_to_num(np.atleast_2d(np.asarray(gpu, dtype=float))) * active
+        columns = [np.ones((active.shape[0], 1)), active, cpu, mem, gpu]
+        if self.quadratic:
+            columns.append(cpu * cpu / 100)
+        return np.hstack(columns)
+
+    def predict(self, active, cpu, mem, gpu=None):
+        """Predict cluster power in W for every state of the batch."""
+        return self.features(active, cpu, mem, gpu) @ self.weights
+
+    def predict_active_sets(self, cpu, mem):
+        """
+        Predict power for every on/off combination of the nodes under the current load.
+
+        The CPU and memory load of the cluster (sum of node percentages) is spread evenly
+        over the nodes that stay on, the all-off set is skipped. Sets that cannot hold the
+        load (over 100 % per node) get ``inf``.
+
+        :param cpu: Current per-node CPU usage in percent.
+        :param mem: Current per-node memory usage in percent.
+        :return: ``(sets, power)``, the ``(2**n - 1, n)`` on/off matrix and its predicted power.
+        """
+        sets = active_node_sets(len(self.nodes))[1:]
+        count = sets.sum(axis=1, keepdims=True)
+        cpu_share = np.nansum(cpu) / count * sets
+        mem_share = np.nansum(mem) / count * sets
+        power = self.predict(sets, cpu_share, mem_share)
+        fits = (cpu_share.max(axis=1) <= 100) & (mem_share.max(axis=1) <= 100)
+        return sets, np.where(fits, power, np.inf)
+
+    def predict_placements(self, active, cpu, mem, cpu_delta, mem_delta=0.0):
+        """
+        Predict power after adding a load to each node in turn.
+
+        :param active: Current per-node on/off flags.
+        :param cpu: Current per-node CPU usage in percent.
+        :param mem: Current per-node memory usage in percent.
+        :param cpu_delta: CPU usage in percent the placement adds to its node.
+        :param mem_delta: Memory usage in percent the placement adds to its node.
+        :return: Predicted power per target node, ``inf`` for nodes that are off.
+        """
+        n = len(self.nodes)
+        eye = np.eye(n)
+        active = np.broadcast_to(np.asarray(active, dtype=bool), (n, n))
+        power = self.predict(active, np.nan_to_num(cpu) + eye * cpu_delta, np.nan_to_num(mem) + eye * mem_delta)
+        return np.where(np.diag(active), power, np.inf)
+
+    def update(self, active, cpu, mem, power, gpu=None):
+        """
+        Fold measured samples into the coefficients.
+
+        :param active: ``(nodes,)`` or ``(batch, nodes)`` on/off flags.
+        :param cpu: Per-node CPU usage in percent, same shape as ``active``.
+        :param mem: Per-node memory usage in percent, same shape as ``active``.
+        :param power: Measured cluster power in W, scalar or ``(batch,)``.
+        :param gpu: Per-node GPU usage in percent, same shape as ``active``.
+        :return: The a-priori prediction errors in W.
+        """
+        X = self.features(active, cpu, mem, gpu)
+        power = np.atleast_1d(np.asarray(power, dtype=float))
+        errors = np.empty(len(power))
+        w, P, lam = self.weights, self.P, self.forgetting
+        for i in range(len(power)):
+            x = X[i]
+            Px = P @ x
+            gain = Px / (lam + x @ Px)
+            errors[i] = power[i] - w @ x
+            w += gain * errors[i]
+            P -= np.outer(gain, Px)
+            if np.trace(P) < self.max_trace:
+                P /= lam
+        self.samples += len(power)
+        return errors
+
+    def update_from_monitor(self, monitor_result):
+        """
+        Fold in one ``monitor_cluster`` result.
+
+        Incomplete ticks are skipped rather than learned with made-up zeros: a failed
+        Prometheus query, a node without a status, or a powered node without CPU or memory
+        usage.
+
+        :return: The a-priori prediction error in W, None if the result was skipped.
+        """
+        if 'Power' not in monitor_result or monitor_result.get('failed_queries'):
+            return None
+        status = monitor_result.get('node_status', {})
+        cpu = monitor_result.get('cpu_usage_percentage', {})
+        mem = monitor_result.get('mem_usage_percentage', {})
+        gpu = monitor_result.get('gpu_usage_percentage', {})
+        for node in self.nodes:
+            if node not in status or (status[node] and (node not in cpu or node not in mem)):
+                return None
+        return self.update([bool(status.get(node)) for node in self.nodes],
+                           [cpu.get(node, 0.0) for node in self.nodes],
+                           [mem.get(node, 0.0) for node in self.nodes],
+                           monitor_result['Power'],
+                           [gpu.get(node, 0.0) for node in self.nodes])[0]
+
+
+PROFILE = 'dataset/profile-cpu.csv'
+
+
+class SharedPowerModel:
+    """
+    Cluster power with one set of coefficients shared by all nodes.
+
+    Power is ``base`` plus, per powered node, ``idle + linear * u + quadratic * u**2`` over
+    its CPU usage ``u`` in percent. Unlike ``PowerModel`` it needs no per-node history, so
+    it is fitted once offline on a profiling trace; a per-node fit of the profiles is ill
+    conditioned because cillium1 and cillium2 never power off.
+    """
+
+    def __init__(self, base, idle, linear, quadratic=0.0):
+        """
+        :param base: W the cluster draws with every node off (switch, PDU).
+        :param idle: W per powered node.
+        :param linear: W per CPU percent.
+        :param quadratic: W per squared CPU percent.
+        """
+        self.base = base
+        self.idle = idle
+        self.linear = linear
+        self.quadratic = quadratic
+
+    @classmethod
+    def fit(cls, active, cpu, power, quadratic=True):
+        """
+        Least-squares fit of ``power ~ n_active + sum(cpu) + sum(cpu**2)`` over the samples.
+
+        :param active: ``(samples, nodes)`` on/off flags.
+        :param cpu: ``(samples, nodes)`` CPU usage in percent, ignored where the node is off.
+        :param power: ``(samples,)`` measured cluster power in W, NaN samples are dropped.
+        :param quadratic: Fit the squared CPU term, otherwise it is 0.
+        """
+        active = np.asarray(active, dtype=float)
+        cpu = np.nan_to_num(np.asarray(cpu, dtype=float)) * active
+        power = np.asarray(power, dtype=float)
+        columns = [np.ones(len(power)), active.sum(axis=1), cpu.sum(axis=1)]
+        if quadratic:
+            columns.append((cpu * cpu).sum(axis=1))
+        X = np.column_stack(columns)
+        valid = ~np.isnan(power)
+        weights = np.linalg.lstsq(X[valid], power[valid], rcond=None)[0]
+        return cls(*map(float, weights))
+
+    @classmethod
+    def fit_csv(cls, csv_file, quadratic=True):
+        """
+        Fit on a CSV written by the old ``monitor_cluster``, such as ``dataset/profile-cpu.csv``.
+
+        The dict cells are parsed directly rather than through ``monitor_store``, so the
+        scheduler can fit its default model without pandas.
+        """
+        import csv
+        from ast import literal_eval
+
+        samples = []
+        with open(csv_file, newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            for values in reader:
+                record = dict(zip(header, values))
+                if record.get('Power') and record.get('node_status'):
+                    samples.append((literal_eval(record['node_status']),
+                                    literal_eval(record['cpu_usage_percentage'] or '{}'),
+                                    float(record['Power'])))
+        nodes = sorted({node for status, _, _ in samples for node in status})
+        active = [[status.get(node, False) for node in nodes] for status, _, _ in samples]
+        cpu = [[usage.get(node, 0.0) for node in nodes] for _, usage, _ in samples]
+        return cls.fit(active, cpu, [power for _, _, power in samples], quadratic)
+
+    def node_power(self, cpu):
+        """W one powered node adds at CPU usage ``cpu`` percent, idle draw included."""
+        return self.idle + self.linear * cpu + self.quadratic * cpu * cpu
+
+    def __call__(self, active, cpu):
+        """Cluster power in W for per-node on/off flags and CPU usage in percent."""
+        return self.base + sum(self.node_power(u) for on, u in zip(active, cpu) if on)
+
+
+_profile_models = {}
+
+
+def profile_model(csv_file=PROFILE):
+    """The ``SharedPowerModel`` fitted on ``csv_file``, fitted once per process."""
+    if csv_file not in _profile_models:
+        _profile_models[csv_file] = SharedPowerModel.fit_csv(csv_file)
+    return _profile_models[csv_file]
+
+
+def load_trace(directory, nodes=None):
+    """
+    Read ``(active, cpu, mem, gpu, power)`` arrays from a directory written by ``monitor_store``.
+
+    :param nodes: Column order of the per-node arrays, every node of the trace if omitted.
+    """
+    import monitor_store
+
+    df = monitor_store.load(directory)
+    if nodes is None:
+        nodes = sorted(monitor_store.node_columns(df, 'node_status').columns)
+    active = monitor_store.node_columns(df, 'node_status').reindex(columns=nodes).fillna(0).to_numpy(bool)
+    cpu, mem, gpu = (monitor_store.node_columns(df, metric).reindex(columns=nodes).to_numpy(float)
+                     for metric in ('cpu_usage_percentage', 'mem_usage_percentage', 'gpu_usage_percentage'))
+    return active, cpu, mem, gpu, df['Power'].to_numpy(float)
+
+
+def benchmark(paths, output_directory, nodes=('cillium1', 'cillium2', 'cillium3', 'cillium4')):
+    """
+    Replay the monitor traces in ``paths`` through the model and time batch prediction.
+
+    Accuracy is prequential: each sample is predicted before the model learns from it,
+    so the error is what an online controller would see. The logged
+    ``predicted_power_usage`` of ``dataset/power_estimation.csv`` is shown for reference.
+    """
+    import os
+    import time
+    import pandas as pd
+    import monitor_store
+
+    model = PowerModel(nodes)
+    errors = []
+    start = time.perf_counter()
+    for path in paths:
+        if not monitor_store.is_legacy(path):
+            continue
+        directory = os.path.join(output_directory, os.path.splitext(os.path.basename(path))[0])
+        if not os.path.isdir(directory):
+            monitor_store.convert(path, directory)
+        active, cpu, mem, gpu, power = load_trace(directory, list(nodes))
+        last_cpu, last_mem = cpu[-1], mem[-1]
+        errors.append(model.update(active, cpu, mem, power, gpu))
+    update_time = time.perf_counter() - start
+    errors = np.concatenate(errors)
+    warm = errors[len(errors) // 10:]
+
+    print(f"Samples               : {len(errors)}, {len(errors) / update_time:.0f} updates/s")
+    print(f"Online MAE            : {np.abs(errors).mean():.1f} W (after first 10%: {np.abs(warm).mean():.1f} W)")
+    if os.path.isfile('dataset/power_estimation.csv'):
+        logged = pd.read_csv('dataset/power_estimation.csv')
+        print(f"Logged estimate MAE   : {(logged['predicted_power_usage'] - logged['power_usage']).abs().mean():.1f} W")
+
+    batch = 100000
+    rng = np.random.default_rng(0)
+    active = rng.random((batch, len(nodes))) < 0.75
+    cpu = rng.uniform(0, 100, (batch, len(nodes)))
+    mem = rng.uniform(0, 100, (batch, len(nodes)))
+    start = time.perf_counter()
+    model.predict(active, cpu, mem)
+    elapsed = time.perf_counter() - start
+    print(f"Batch prediction      : {batch / elapsed:.0f} predictions/s ({batch} states per call)")
+
+    start = time.perf_counter()
+    sets, power = model.predict_active_sets(last_cpu, last_mem)
+    elapsed = time.perf_counter() - start
+    best = sets[np.argmin(power)]
+    print(f"Cheapest active set   : {[node for node, on in zip(nodes, best) if on]} at {power.min():.0f} W "
+          f"for the last traced load, {len(sets)} sets scored in {elapsed * 1e6:.0f} us")
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) == 3 and sys.argv[1] == '--fit':
+        shared = SharedPowerModel.fit_csv(sys.argv[2])
+        print(f"base {shared.base:.1f} W, idle {shared.idle:.1f} W/node, linear {shared.linear:.4f} W/%, "
+              f"quadratic {shared.quadratic:.6f} W/%^2")
+        sys.exit(0)
+    if len(sys.argv) < 3:
+        print("Usage: python power_model.py OUTPUT_DIR CSV_FILE... | python power_model.py --fit CSV_FILE")
+        sys.exit(1)
+    benchmark(sys.argv[2:], sys.argv[1])
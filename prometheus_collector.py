@@ -0,0 +1,152 @@
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+import instrumentation
+
+QUERY_SECONDS = instrumentation.histogram('prometheus_query_seconds', 'Latency of PromQL queries.', ['query'])
+QUERY_ERRORS = instrumentation.counter('prometheus_query_errors_total',
+                                       'PromQL queries that failed or missed the tick deadline.', ['query'])
+
+
+class PrometheusCollector:
+    """
+    Run a batch of PromQL instant queries concurrently over one keep-alive session.
+
+    Every tick shares a pooled ``requests.Session`` so connections to Prometheus are
+    reused instead of re-opened per query, and all queries of a tick are bounded by a
+    single deadline. Queries that miss the deadline or fail are left out of the
+    result, everything that did arrive is kept.
+    """
+
+    def __init__(self, url, max_workers=8, deadline=10.0):
+        """
+        :param url: The Prometheus ``/api/v1/query`` endpoint.
+        :param max_workers: Number of queries that may be in flight at once.
+        :param deadline: Default per-tick deadline in seconds.
+        """
+        self.url = url
+        self.deadline = deadline
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prometheus')
+        self.last_latency = {}
+        self.last_errors = {}
+
+    def query(self, promql, timeout=None):
+        """
+        Perform a single PromQL instant query.
+
+        :param promql: The PromQL expression.
+        :param timeout: Request timeout in seconds (defaults to the collector deadline).
+        :return: The ``data.result`` list of the response.
+        """
+        response = self.session.get(self.url, params={'query': promql}, timeout=timeout or self.deadline)
+        response.raise_for_status()
+        return response.json()['data']['result']
+
+    def _timed_query(self, promql, timeout):
+        start = time.perf_counter()
+        result = self.query(promql, timeout)
+        return result, time.perf_counter() - start
+
+    def collect(self, queries, deadline=None):
+        """
+        Run all queries of a tick at once.
+
+        :param queries: Mapping of result name to PromQL expression.
+        :param deadline: Hard deadline for the whole tick in seconds.
+        :return: Mapping of result name to ``data.result`` for every query that finished in time.
+        """
+        deadline = deadline or self.deadline
+        futures = {self.executor.submit(self._timed_query, promql, deadline): name
+                   for name, promql in queries.items()}
+        done, not_done = wait(futures, timeout=deadline)
+
+        results, latency, errors = {}, {}, {}
+        for future in done:
+            name = futures[future]
+            try:
+                results[name], latency[name] = future.result()
+                QUERY_SECONDS.observe(latency[name], name)
+            except Exception as e:
+                errors[name] = e
+                QUERY_ERRORS.inc(name)
+        for future in not_done:
+            future.cancel()
+            errors[futures[future]] = TimeoutError(f"no response within {deadline}s")
+            QUERY_ERRORS.inc(futures[future])
+
+        self.last_latency = latency
+        self.last_errors = errors
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+def benchmark(delays=(0.05, 0.1, 0.2, 0.3, 0.5), rounds=5):
+    """
+    Compare sequential ``requests.get`` against the collector on a local stub Prometheus.
+
+    Each stub query sleeps for one of ``delays``, so a concurrent tick should take about
+    ``max(delays)`` while the sequential path takes ``sum(delays)``.
+    """
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    delay_by_query = {f'query_{i}': delay for i, delay in enumerate(delays)}
+
+    class StubPrometheus(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            promql = parse_qs(urlparse(self.path).query)['query'][0]
+            time.sleep(delay_by_query[promql])
+            body = json.dumps({'status': 'success', 'data': {'resultType': 'vector', 'result': []}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubPrometheus)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/api/v1/query'
+    queries = {promql: promql for promql in delay_by_query}
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for promql in queries.values():
+            requests.get(url, params={'query': promql}).json()
+    sequential = (time.perf_counter() - start) / rounds
+
+    collector = PrometheusCollector(url, deadline=max(delays) * 4)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        collector.collect(queries)
+    concurrent = (time.perf_counter() - start) / rounds
+    latency = collector.last_latency
+
+    partial = collector.collect(queries, deadline=max(delays) * 0.8)
+    collector.close()
+    server.shutdown()
+
+    print(f"Slowest query     : {max(delays):.3f} s")
+    print(f"Sum of queries    : {sum(delays):.3f} s")
+    print(f"Sequential tick   : {sequential:.3f} s")
+    print(f"Concurrent tick   : {concurrent:.3f} s")
+    print(f"Per-query latency : { {name: round(value, 3) for name, value in latency.items()} }")
+    print(f"Partial tick      : {len(partial)}/{len(queries)} queries within {max(delays) * 0.8:.3f} s")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,172 @@
+import numpy as np
+
+STATE_SIZE = 17
+ACTION_SIZE = 5
+LAYERS = ['fc1', 'fc2', 'fc3', 'fc4']
+# Keras Q-values of the training_data.csv states for checkpoint_idle, written by save_reference
+REFERENCE = 'q-network/reference_q_values.npy'
+
+
+def load_weights(path, mmap=False):
+    """
+    Read the Dense layer weights of a Keras ``.weights.h5`` checkpoint.
+
+    :param path: The checkpoint, e.g. ``q-network/checkpoint_idle.weights.h5``.
+    :param mmap: Map the arrays straight from the file instead of copying them into memory.
+                 Only possible for uncompressed, contiguous datasets, others are read.
+    :return: List of ``(kernel, bias)`` float32 arrays, one pair per layer.
+    """
+    import h5py
+
+    layers = []
+    with h5py.File(path, 'r') as f:
+        for name in LAYERS:
+            pair = []
+            for index in ('0', '1'):
+                dataset = f[name]['vars'][index]
+                offset = dataset.id.get_offset()
+                if mmap and offset is not None and dataset.chunks is None:
+                    array = np.memmap(path, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+                else:
+                    array = np.ascontiguousarray(dataset[()], dtype=np.float32)
+                pair.append(array)
+            layers.append(tuple(pair))
+    return layers
+
+
+class QNetwork:
+    """
+    NumPy forward pass of the node controller Q-network.
+
+    The network maps a 17-value state (the ``State`` layout of ``training_data.csv``) to
+    one Q-value per action through Dense 256-128-64 ReLU layers and a linear Dense 5
+    output, the same layers the Keras checkpoint holds. No deep-learning framework is
+    imported.
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+
+    @classmethod
+    def load(cls, path='q-network/checkpoint_idle.weights.h5', mmap=False):
+        return cls(load_weights(path, mmap=mmap))
+
+    def q_values(self, states):
+        """
+        Score every action for a batch of states.
+
+        :param states: ``(batch, 17)`` or ``(17,)`` array-like.
+        :return: ``(batch, 5)`` float32 Q-values.
+        """
+        h = np.atleast_2d(np.asarray(states, dtype=np.float32))
+        last = len(self.layers) - 1
+        for i, (kernel, bias) in enumerate(self.layers):
+            h = h @ kernel
+            h += bias
+            if i < last:
+                np.maximum(h, 0, out=h)
+        return h
+
+    def act(self, states):
+        """Return the greedy action of every state."""
+        return self.q_values(states).argmax(axis=1)
+
+
+def keras_reference(path='q-network/checkpoint_idle.weights.h5'):
+    """Build the Keras model the checkpoint was saved from, to check the NumPy runtime against."""
+    import keras
+
+    class KerasQNetwork(keras.Model):
+        def __init__(self):
+            super().__init__()
+            self.fc1 = keras.layers.Dense(256, activation='relu')
+            self.fc2 = keras.layers.Dense(128, activation='relu')
+            self.fc3 = keras.layers.Dense(64, activation='relu')
+            self.fc4 = keras.layers.Dense(ACTION_SIZE)
+
+        def call(self, x):
+            return self.fc4(self.fc3(self.fc2(self.fc1(x))))
+
+    model = KerasQNetwork()
+    model(np.zeros((1, STATE_SIZE), dtype=np.float32))
+    model.load_weights(path)
+    return model
+
+
+def save_reference(path='q-network/checkpoint_idle.weights.h5', reference=REFERENCE):
+    """Store the Keras Q-values of the ``training_data.csv`` states, rerun when the checkpoint changes."""
+    np.save(reference, np.asarray(keras_reference(path)(load_states()), dtype=np.float32))
+
+
+def check_reference(net, reference=REFERENCE):
+    """
+    Assert that ``net`` matches the stored Keras Q-values and greedy actions.
+
+    :return: The largest absolute Q-value error.
+    """
+    states = load_states()
+    expected = np.load(reference)
+    q_values = net.q_values(states)
+    error = np.abs(q_values - expected).max()
+    assert np.allclose(q_values, expected, rtol=1e-5, atol=1e-4), f"max abs error {error}"
+    assert (q_values.argmax(axis=1) == expected.argmax(axis=1)).all()
+    return error
+
+
+def load_states(csv_file='q-network/training_data.csv'):
+    """Read the ``State`` column of the training data as a ``(rows, 17)`` array."""
+    import csv
+    from ast import literal_eval
+
+    with open(csv_file, newline='') as file:
+        return np.array([literal_eval(row['State']) for row in csv.DictReader(file)], dtype=np.float32)
+
+
+def _startup(code):
+    """Run ``code`` in a fresh interpreter, return its wall time and peak RSS in MiB."""
+    import subprocess
+    import sys
+
+    script = ("import time, resource; start = time.perf_counter()\n" + code +
+              "\nprint(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+    elapsed, rss = output.split()[-2:]
+    return float(elapsed), int(rss) / 1024
+
+
+def benchmark(path='q-network/checkpoint_idle.weights.h5', rounds=2000):
+    """
+    Report startup time, peak RSS and per-decision latency, and check outputs against Keras.
+    """
+    import time
+
+    states = load_states()
+    for mmap in (False, True):
+        elapsed, rss = _startup(f"import q_network; q_network.QNetwork.load({path!r}, mmap={mmap}).act([[0] * 17])")
+        print(f"NumPy runtime (mmap={mmap!s:5}): startup {elapsed:.3f} s, RSS {rss:.0f} MiB")
+
+    net = QNetwork.load(path)
+    start = time.perf_counter()
+    for i in range(rounds):
+        net.act(states[i % len(states)])
+    single = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds // 10):
+        net.q_values(states)
+    batch = (time.perf_counter() - start) / (rounds // 10)
+    print(f"Per decision               : {single * 1e6:.1f} us, batch of {len(states)}: {batch * 1e6:.1f} us")
+
+    error = check_reference(net)
+    check_reference(QNetwork.load(path, mmap=True))
+    print(f"Max abs error vs Keras     : {error:.2e} over {len(states)} states ({REFERENCE}), same greedy actions")
+
+    try:
+        elapsed, rss = _startup(f"import q_network; q_network.keras_reference({path!r})")
+    except Exception:
+        print("Keras reference            : startup not measured, Keras could not build the model here")
+        return
+    print(f"Keras reference            : startup {elapsed:.3f} s, RSS {rss:.0f} MiB")
+
+
+if __name__ == '__main__':
+    benchmark()
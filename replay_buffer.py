@@ -0,0 +1,282 @@
+import os
+import json
+import numpy as np
+
+STATE_SIZE = 17
+
+# Field name -> (dtype, shape of one transition), the columns of q-network/training_data.csv
+FIELDS = {
+    'state': (np.float32, (STATE_SIZE,)),
+    'action': (np.int8, ()),
+    'reward': (np.float32, ()),
+    'next_state': (np.float32, (STATE_SIZE,)),
+    'predicted_energy': (np.float32, ()),
+    'completed_batch_job': (np.int32, ()),
+    'long_running_job': (np.int32, ()),
+}
+
+
+class SumTree:
+    """
+    Binary tree over transition priorities stored in one flat array.
+
+    Leaf ``i`` sits at ``tree[leaves + i]`` and every inner node holds the sum of its
+    children, so the root is the total priority. Updates and prefix-sum lookups walk
+    one level per step for the whole batch at once.
+    """
+
+    def __init__(self, capacity, tree=None):
+        self.leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.depth = self.leaves.bit_length() - 1
+        self.tree = np.zeros(2 * self.leaves) if tree is None else tree
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.leaves
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """Return the leaf index holding each prefix-sum value."""
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            right = values > self.tree[left]
+            values -= self.tree[left] * right
+            nodes = left + right
+        return nodes - self.leaves
+
+
+class ReplayBuffer:
+    """
+    Fixed-size experience replay on preallocated NumPy arrays.
+
+    Transitions overwrite the oldest ones once ``capacity`` is reached. With
+    ``prioritized`` set, sampling is proportional to ``priority ** alpha`` through a
+    ``SumTree`` and returns importance weights. When a ``directory`` is given every array
+    is a memory-mapped ``.npy`` file there, so a later run reopens the buffer with
+    ``ReplayBuffer.open`` instead of re-parsing the CSV.
+    """
+
+    def __init__(self, capacity, prioritized=False, alpha=0.6, directory=None):
+        """
+        :param capacity: Maximum number of transitions kept.
+        :param prioritized: Sample by priority instead of uniformly.
+        :param alpha: How strongly priorities shape sampling, 0 is uniform.
+        :param directory: Persist the arrays here as memory-mapped files.
+        """
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.directory = directory
+        self.index = 0
+        self.size = 0
+        self.max_priority = 1.0
+        self.arrays = {}
+        for name, (dtype, shape) in FIELDS.items():
+            self.arrays[name] = self._allocate(name, dtype, (capacity, *shape))
+        self.tree = None
+        if prioritized:
+            tree = SumTree(capacity)
+            tree.tree = self._allocate('priority_tree', np.float64, tree.tree.shape)
+            self.tree = tree
+        if directory:
+            self.flush()
+
+    def _allocate(self, name, dtype, shape):
+        if not self.directory:
+            return np.zeros(shape, dtype=dtype)
+        os.makedirs(self.directory, exist_ok=True)
+        return np.lib.format.open_memmap(os.path.join(self.directory, f'{name}.npy'), mode='w+', dtype=dtype,
+                                         shape=shape)
+
+    @classmethod
+    def open(cls, directory):
+        """Reopen a buffer persisted in ``directory``."""
+        with open(os.path.join(directory, 'meta.json')) as file:
+            meta = json.load(file)
+        buffer = cls.__new__(cls)
+        buffer.__dict__.update(meta)
+        buffer.directory = directory
+        buffer.arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r+') for name in FIELDS}
+        buffer.tree = None
+        if buffer.prioritized:
+            buffer.tree = SumTree(buffer.capacity, np.load(os.path.join(directory, 'priority_tree.npy'), mmap_mode='r+'))
+        return buffer
+
+    def flush(self):
+        """Write the arrays and the write position to disk (no-op in memory)."""
+        if not self.directory:
+            return
+        for array in self.arrays.values():
+            array.flush()
+        if self.tree is not None:
+            self.tree.tree.flush()
+        meta = {'capacity': self.capacity, 'prioritized': self.prioritized, 'alpha': self.alpha,
+                'index': self.index, 'size': self.size, 'max_priority': self.max_priority}
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as file:
+            json.dump(meta, file)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, **transition):
+        """Add one transition, keyword arguments are the ``FIELDS`` names."""
+        self.add_batch(**{name: np.asarray(value)[None] for name, value in transition.items()})
+
+    def add_batch(self, **transitions):
+        """
+        Add many transitions at once, each keyword argument holds one field for all of them.
+        """
+        count = len(transitions['state'])
+        indices = (self.index + np.arange(count)) % self.capacity
+        for name, values in transitions.items():
+            self.arrays[name][indices] = values
+        if self.tree is not None:
+            self.tree.update(indices[-self.capacity:], self.max_priority ** self.alpha)
+        self.index = (self.index + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+
+    def sample(self, batch_size, beta=0.4, rng=np.random):
+        """
+        Draw a minibatch.
+
+        :param batch_size: Number of transitions.
+        :param beta: Importance-weight correction for prioritized sampling, 1 is full correction.
+        :param rng: A NumPy ``Generator`` or the ``np.random`` module.
+        :return: Dict of field arrays plus ``indices`` and ``weights``.
+        """
+        if self.tree is None:
+            indices = rng.integers(0, self.size, batch_size) if hasattr(rng, 'integers') else rng.randint(0, self.size, batch_size)
+            weights = np.ones(batch_size, dtype=np.float32)
+        else:
+            # One stratified draw per segment of the total priority
+            segment = self.tree.total / batch_size
+            values = (np.arange(batch_size) + rng.random(batch_size)) * segment
+            indices = np.minimum(self.tree.find(values), self.size - 1)
+            probabilities = self.tree.tree[indices + self.tree.leaves] / self.tree.total
+            weights = (self.size * probabilities) ** -beta
+            weights = (weights / weights.max()).astype(np.float32)
+        batch = {name: array[indices] for name, array in self.arrays.items()}
+        batch['indices'] = indices
+        batch['weights'] = weights
+        return batch
+
+    def update_priorities(self, indices, priorities):
+        """Set new priorities (e.g. absolute TD errors) for sampled transitions."""
+        priorities = np.asarray(priorities, dtype=np.float64) + 1e-6
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def nbytes_per_transition(self):
+        total = sum(array.itemsize * int(np.prod(array.shape[1:])) for array in self.arrays.values())
+        if self.tree is not None:
+            total += self.tree.tree.nbytes / self.capacity
+        return total
+
+
+def read_csv(csv_file='q-network/training_data.csv'):
+    """
+    Parse ``training_data.csv`` into field arrays.
+
+    :return: Dict of ``FIELDS`` name to array, one row per transition.
+    """
+    import csv
+    from ast import literal_eval
+
+    columns = {name: [] for name in FIELDS}
+    with open(csv_file, newline='') as file:
+        for row in csv.DictReader(file):
+            columns['state'].append(literal_eval(row['State']))
+            columns['action'].append(int(row['Action']))
+            columns['reward'].append(float(row['Reward']))
+            columns['next_state'].append(literal_eval(row['Next State']))
+            columns['predicted_energy'].append(float(row['Predicted Energy']))
+            columns['completed_batch_job'].append(int(row['completed_batch_job']))
+            columns['long_running_job'].append(int(row['long_runnning_job']))
+    return {name: np.asarray(values, dtype=FIELDS[name][0]) for name, values in columns.items()}
+
+
+def import_csv(csv_file, buffer):
+    """Append every transition of ``csv_file`` to ``buffer``, return the number added."""
+    columns = read_csv(csv_file)
+    buffer.add_batch(**columns)
+    buffer.flush()
+    return len(columns['state'])
+
+
+def benchmark(csv_file='q-network/training_data.csv', capacity=100000, batch_size=64, rounds=2000):
+    """
+    Compare the CSV path with the buffer: load time, memory per transition and sample throughput.
+
+    The CSV is tiled up to ``capacity`` rows to look like a long run.
+    """
+    import tempfile
+    import time
+    import pandas as pd
+    from ast import literal_eval
+
+    columns = read_csv(csv_file)
+    repeat = -(-capacity // len(columns['state']))
+    columns = {name: np.concatenate([values] * repeat)[:capacity] for name, values in columns.items()}
+
+    with tempfile.TemporaryDirectory() as directory:
+        big_csv = os.path.join(directory, 'training_data.csv')
+        pd.DataFrame({
+            'State': [str(list(map(float, s))) for s in columns['state']],
+            'Action': columns['action'], 'Reward': columns['reward'],
+            'Next State': [str(list(map(float, s))) for s in columns['next_state']],
+            'Predicted Energy': columns['predicted_energy'],
+            'completed_batch_job': columns['completed_batch_job'],
+            'long_runnning_job': columns['long_running_job'],
+        }).to_csv(big_csv, index=False)
+
+        start = time.perf_counter()
+        df = pd.read_csv(big_csv)
+        df['State'] = df['State'].apply(literal_eval)
+        df['Next State'] = df['Next State'].apply(literal_eval)
+        csv_load = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(rounds // 10):
+            rows = df.sample(batch_size)
+            np.array(rows['State'].tolist(), dtype=np.float32), np.array(rows['Next State'].tolist(), dtype=np.float32)
+        csv_rate = rounds // 10 * batch_size / (time.perf_counter() - start)
+        csv_bytes = os.path.getsize(big_csv) / capacity
+
+        store = os.path.join(directory, 'replay')
+        buffer = ReplayBuffer(capacity, prioritized=True, directory=store)
+        buffer.add_batch(**columns)
+        buffer.flush()
+        start = time.perf_counter()
+        buffer = ReplayBuffer.open(store)
+        buffer_load = time.perf_counter() - start
+
+        rng = np.random.default_rng(0)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            batch = buffer.sample(batch_size, rng=rng)
+            buffer.update_priorities(batch['indices'], np.abs(batch['reward']))
+        prioritized_rate = rounds * batch_size / (time.perf_counter() - start)
+
+        uniform = ReplayBuffer(capacity)
+        uniform.add_batch(**columns)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            uniform.sample(batch_size, rng=rng)
+        uniform_rate = rounds * batch_size / (time.perf_counter() - start)
+
+        print(f"Transitions           : {capacity}")
+        print(f"CSV                   : load {csv_load:.2f} s, {csv_bytes:.0f} B/transition on disk, "
+              f"{csv_rate:.0f} samples/s")
+        print(f"Replay buffer         : open {buffer_load * 1000:.1f} ms, {buffer.nbytes_per_transition():.0f} B/transition, "
+              f"{uniform_rate:.0f} samples/s uniform, {prioritized_rate:.0f} samples/s prioritized with updates")
+
+
+if __name__ == '__main__':
+    benchmark()
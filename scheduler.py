@@ -0,0 +1,374 @@
+import math
+import threading
+import time
+from kubernetes import watch
+from kubernetes.client.exceptions import ApiException
+
+MEMORY_UNITS = {'Ki': 2**10, 'Mi': 2**20, 'Gi': 2**30, 'Ti': 2**40, 'Pi': 2**50, 'Ei': 2**60,
+                'k': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12, 'P': 1e15, 'E': 1e18}
+
+
+def parse_cpu(quantity):
+    """Convert a Kubernetes CPU quantity ('250m', '2') to cores."""
+    if not quantity:
+        return 0.0
+    quantity = str(quantity)
+    if quantity.endswith('m'):
+        return float(quantity[:-1]) / 1000
+    return float(quantity)
+
+
+def parse_memory(quantity):
+    """Convert a Kubernetes memory quantity ('128Mi', '1G', '1e9') to bytes."""
+    if not quantity:
+        return 0.0
+    quantity = str(quantity)
+    for suffix in sorted(MEMORY_UNITS, key=len, reverse=True):
+        if quantity.endswith(suffix):
+            return float(quantity[:-len(suffix)]) * MEMORY_UNITS[suffix]
+    return float(quantity)
+
+
+def pod_requests(pod):
+    """
+    Sum the CPU and memory requests of all containers of a pod.
+
+    :return: ``(cpu_cores, memory_bytes)``, or None if no container sets a request.
+    """
+    cpu, memory, found = 0.0, 0.0, False
+    for container in pod.spec.containers or []:
+        if container.resources and container.resources.requests:
+            found = True
+            cpu += parse_cpu(container.resources.requests.get('cpu'))
+            memory += parse_memory(container.resources.requests.get('memory'))
+    return (cpu, memory) if found else None
+
+
+def is_workload(pod):
+    """
+    Tell workload pods from per-node system pods.
+
+    DaemonSet pods (the Cilium agent, node-exporter) and static mirror pods run on every
+    node whether or not it has work, so they do not keep a node from being idle.
+    """
+    if any(owner.kind == 'DaemonSet' for owner in pod.metadata.owner_references or []):
+        return False
+    return 'kubernetes.io/config.mirror' not in (pod.metadata.annotations or {})
+
+
+class NodeInfo:
+    __slots__ = ('name', 'cpu_allocatable', 'mem_allocatable', 'cpu_requested', 'mem_requested', 'ready', 'pods',
+                 'workloads')
+
+    def __init__(self, name):
+        self.name = name
+        self.cpu_allocatable = 0.0
+        self.mem_allocatable = 0.0
+        self.cpu_requested = 0.0
+        self.mem_requested = 0.0
+        self.ready = False
+        self.pods = 0
+        # Pods counted in ``pods`` that are not DaemonSet or mirror pods
+        self.workloads = 0
+
+    def fits(self, cpu, memory):
+        return (self.ready
+                and self.cpu_requested + cpu <= self.cpu_allocatable
+                and self.mem_requested + memory <= self.mem_allocatable)
+
+
+class ClusterCache:
+    """
+    In-memory view of node capacity and the requests already committed to each node.
+
+    The cache is kept current from node and pod watch events, one event updates one
+    node in O(1). Pods the scheduler has just bound are counted right away through
+    ``assume``, before their watch event arrives. After a re-list, ``replace_nodes`` and
+    ``replace_pods`` drop whatever was deleted while the watch was down; assumed pods
+    younger than ``assume_ttl`` seconds are kept, their binding may not be listed yet.
+    """
+
+    assume_ttl = 30.0
+
+    def __init__(self):
+        self.nodes = {}
+        # pod uid -> (node name, cpu, memory, workload) of every pod counted against a node
+        self.pods = {}
+        # pod uid -> monotonic time of assumed pods no watch event has confirmed yet
+        self.assumed = {}
+        self.lock = threading.Lock()
+
+    def on_node_event(self, event_type, node):
+        name = node.metadata.name
+        with self.lock:
+            if event_type == 'DELETED':
+                self.nodes.pop(name, None)
+                return
+            info = self.nodes.get(name)
+            if info is None:
+                info = self.nodes[name] = NodeInfo(name)
+            allocatable = node.status.allocatable or {}
+            info.cpu_allocatable = parse_cpu(allocatable.get('cpu'))
+            info.mem_allocatable = parse_memory(allocatable.get('memory'))
+            conditions = node.status.conditions or []
+            info.ready = (not node.spec.unschedulable
+                          and info.cpu_allocatable > 0 and info.mem_allocatable > 0
+                          and any(c.type == 'Ready' and c.status == 'True' for c in conditions))
+
+    def on_pod_event(self, event_type, pod):
+        uid = pod.metadata.uid
+        terminated = pod.status is not None and pod.status.phase in ('Succeeded', 'Failed')
+        if event_type == 'DELETED' or terminated:
+            self.forget(uid)
+            return
+        if pod.spec.node_name:
+            self.assumed.pop(uid, None)
+            if uid not in self.pods:
+                cpu, memory = pod_requests(pod) or (0.0, 0.0)
+                self._commit(uid, pod.spec.node_name, cpu, memory, is_workload(pod))
+
+    def assume(self, pod, node_name, cpu, memory):
+        """Count a pod against ``node_name`` as soon as its binding has been sent."""
+        self.assumed[pod.metadata.uid] = time.monotonic()
+        self._commit(pod.metadata.uid, node_name, cpu, memory)
+
+    def replace_nodes(self, nodes):
+        """Make the listed nodes the only ones known, then apply each as ADDED."""
+        names = {node.metadata.name for node in nodes}
+        with self.lock:
+            for name in [name for name in self.nodes if name not in names]:
+                del self.nodes[name]
+        for node in nodes:
+            self.on_node_event('ADDED', node)
+
+    def replace_pods(self, pods):
+        """Stop counting pods missing from a fresh list, then apply each listed pod as ADDED."""
+        listed = {pod.metadata.uid for pod in pods}
+        now = time.monotonic()
+        with self.lock:
+            stale = [uid for uid in self.pods
+                     if uid not in listed and now - self.assumed.get(uid, -math.inf) > self.assume_ttl]
+        for uid in stale:
+            self.forget(uid)
+        for pod in pods:
+            self.on_pod_event('ADDED', pod)
+
+    def _commit(self, uid, node_name, cpu, memory, workload=True):
+        with self.lock:
+            if uid in self.pods:
+                return
+            self.pods[uid] = (node_name, cpu, memory, workload)
+            info = self.nodes.get(node_name)
+            if info is None:
+                info = self.nodes[node_name] = NodeInfo(node_name)
+            info.cpu_requested += cpu
+            info.mem_requested += memory
+            info.pods += 1
+            info.workloads += workload
+
+    def forget(self, uid):
+        """Stop counting a pod, e.g. when it terminated or its binding failed."""
+        with self.lock:
+            self.assumed.pop(uid, None)
+            entry = self.pods.pop(uid, None)
+            if entry is None:
+                return
+            node_name, cpu, memory, workload = entry
+            info = self.nodes.get(node_name)
+            if info is not None:
+                info.cpu_requested -= cpu
+                info.mem_requested -= memory
+                info.pods -= 1
+                info.workloads -= workload
+
+
+def least_allocated(node, cpu, memory):
+    """Spread pods: prefer the node with the most CPU and memory left after placement."""
+    return ((node.cpu_allocatable - node.cpu_requested - cpu) / node.cpu_allocatable
+            + (node.mem_allocatable - node.mem_requested - memory) / node.mem_allocatable)
+
+
+def most_allocated(node, cpu, memory):
+    """Pack pods: prefer the node with the least CPU and memory left after placement."""
+    return -least_allocated(node, cpu, memory)
+
+
+class MarginalPowerScorer:
+    """
+    Prefer the node whose power draw grows least when the pod is placed there.
+
+    Node power is modelled as ``idle`` while the node runs any workload pod, plus
+    ``linear * u + quadratic * u**2`` over its CPU utilization ``u`` in percent, the
+    per-node terms of a ``power_model.SharedPowerModel``. By default that model is
+    fitted on ``dataset/profile-cpu.csv`` (about 72 W per active node, 0.63 W per CPU
+    percent and a small negative curvature, see ``python power_model.py --fit``). The
+    curvature makes the next CPU percent cheaper on a busier node, and the idle draw
+    charges the first workload pod on a node that only runs DaemonSet pods, which could
+    otherwise be powered off. The utilization of a node is the larger of its committed
+    CPU requests and, when a ``MetricsStore`` is given, its measured CPU usage EWMA.
+    """
+
+    def __init__(self, model=None, coefficients=None, metrics=None):
+        """
+        :param model: ``SharedPowerModel`` giving the ``idle``, ``linear`` and ``quadratic``
+                      terms, ``power_model.profile_model()`` if omitted.
+        :param coefficients: Per-node ``(linear, quadratic, idle)`` overrides.
+        :param metrics: Optional ``MetricsStore`` with live CPU usage.
+        """
+        if model is None:
+            import power_model
+            model = power_model.profile_model()
+        self.linear = model.linear
+        self.quadratic = model.quadratic
+        self.idle = model.idle
+        self.coefficients = coefficients or {}
+        self.metrics = metrics
+
+    def marginal_power(self, node, cpu):
+        utilization = node.cpu_requested / node.cpu_allocatable * 100
+        if self.metrics is not None:
+            measured = self.metrics.ewma(node.name, 'cpu_usage_percentage')
+            if not math.isnan(measured):
+                utilization = max(utilization, measured)
+        delta = cpu / node.cpu_allocatable * 100
+        linear, quadratic, idle = self.coefficients.get(node.name, (self.linear, self.quadratic, self.idle))
+        power = linear * delta + quadratic * ((utilization + delta) ** 2 - utilization ** 2)
+        if node.workloads == 0:
+            power += idle
+        return power
+
+    def __call__(self, node, cpu, memory):
+        return -self.marginal_power(node, cpu)
+
+
+class Scheduler:
+    """Pick a node for a pod: filter the cached nodes by fit, then take the best score."""
+
+    def __init__(self, cache, scorer=least_allocated):
+        self.cache = cache
+        self.scorer = scorer
+        self.reserve_lock = threading.Lock()
+
+    def select_node(self, cpu, memory):
+        """
+        :param cpu: Requested CPU cores.
+        :param memory: Requested memory bytes.
+        :return: The name of the best fitting node, or None if no node fits.
+        """
+        best, best_score = None, -math.inf
+        scorer = self.scorer
+        with self.cache.lock:
+            for node in self.cache.nodes.values():
+                if not node.fits(cpu, memory):
+                    continue
+                score = scorer(node, cpu, memory)
+                if score > best_score:
+                    best, best_score = node.name, score
+        return best
+
+    def reserve(self, pod, cpu, memory):
+        """
+        Select a node and count the pod against it in one step.
+
+        Concurrent callers never see the same free capacity twice. Call
+        ``cache.forget`` if the binding fails.
+
+        :return: The reserved node name, or None if no node fits.
+        """
+        with self.reserve_lock:
+            node_name = self.select_node(cpu, memory)
+            if node_name is not None:
+                self.cache.assume(pod, node_name, cpu, memory)
+        return node_name
+
+
+def informer(list_func, handler, replace, watch_timeout=300, **kwargs):
+    """
+    Feed every watch event of ``list_func`` to ``handler(event_type, object)``, forever.
+
+    The objects are listed first and handed to ``replace(items)``, which drops whatever
+    the cache holds that the list no longer has. The watch then starts from the list's
+    resourceVersion and resumes from the last version seen, including bookmarks. Only
+    410 Gone, a version the API server no longer keeps, leads to a new list.
+    """
+    resource_version = None
+    while True:
+        w = watch.Watch()
+        try:
+            if resource_version is None:
+                object_list = list_func(**kwargs)
+                replace(object_list.items)
+                resource_version = object_list.metadata.resource_version
+            for event in w.stream(list_func, resource_version=resource_version, allow_watch_bookmarks=True,
+                                  timeout_seconds=watch_timeout, **kwargs):
+                if event['type'] != 'BOOKMARK':
+                    handler(event['type'], event['object'])
+            resource_version = w.resource_version or resource_version
+        except ApiException as e:
+            if e.status == 410:
+                resource_version = None
+            else:
+                print(f"Watch {list_func.__name__} failed: {e.status} {e.reason}")
+                resource_version = w.resource_version or resource_version
+                time.sleep(1)
+        except Exception as e:
+            print(f"Watch {list_func.__name__} failed: {e}")
+            resource_version = w.resource_version or resource_version
+            time.sleep(1)
+
+
+def start_informers(v1, cache):
+    """Keep ``cache`` current from node and pod watches running on daemon threads."""
+    for list_func, handler, replace in ((v1.list_node, cache.on_node_event, cache.replace_nodes),
+                                        (v1.list_pod_for_all_namespaces, cache.on_pod_event, cache.replace_pods)):
+        threading.Thread(target=informer, args=(list_func, handler, replace), daemon=True).start()
+
+
+class FakeCoreV1Api:
+    """Minimal stand-in for ``CoreV1Api`` holding a fixed set of nodes and bound pods."""
+
+    def __init__(self, nodes=300, pods_per_node=10, cores=8, memory='32Gi'):
+        from kubernetes import client
+
+        self.nodes = [client.V1Node(
+            metadata=client.V1ObjectMeta(name=f'node{i}', resource_version='1'),
+            spec=client.V1NodeSpec(),
+            status=client.V1NodeStatus(allocatable={'cpu': str(cores), 'memory': memory},
+                                       conditions=[client.V1NodeCondition(type='Ready', status='True')]))
+            for i in range(nodes)]
+        self.pods = [client.V1Pod(
+            metadata=client.V1ObjectMeta(name=f'pod{i}-{j}', namespace='default', uid=f'uid-{i}-{j}', resource_version='1'),
+            spec=client.V1PodSpec(node_name=f'node{i}', containers=[client.V1Container(
+                name='main', resources=client.V1ResourceRequirements(requests={'cpu': f'{(i * 7 + j) % 500}m', 'memory': '256Mi'}))]),
+            status=client.V1PodStatus(phase='Running'))
+            for i in range(nodes) for j in range(pods_per_node)]
+
+    def list_node(self, **kwargs):
+        from kubernetes import client
+        return client.V1NodeList(items=self.nodes)
+
+    def list_pod_for_all_namespaces(self, **kwargs):
+        from kubernetes import client
+        return client.V1PodList(items=self.pods)
+
+
+def benchmark(nodes=300, decisions=20000):
+    """Measure scheduling decisions per second on a cache filled from a fake API client."""
+    api = FakeCoreV1Api(nodes=nodes)
+    cache = ClusterCache()
+    for node in api.list_node().items:
+        cache.on_node_event('ADDED', node)
+    for pod in api.list_pod_for_all_namespaces().items:
+        cache.on_pod_event('ADDED', pod)
+
+    for name, scorer in (('least_allocated', least_allocated), ('marginal_power', MarginalPowerScorer())):
+        scheduler = Scheduler(cache, scorer)
+        start = time.perf_counter()
+        for i in range(decisions):
+            scheduler.select_node(0.1 + (i % 10) * 0.05, 128 * 2**20)
+        elapsed = time.perf_counter() - start
+        print(f"{name:16}: {decisions / elapsed:8.0f} decisions/s, {elapsed / decisions * 1e6:6.1f} us/decision on {nodes} nodes")
+
+
+if __name__ == '__main__':
+    benchmark()
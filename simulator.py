@@ -0,0 +1,438 @@
+import csv
+import heapq
+import math
+import time
+import random
+from bisect import bisect_right
+from collections import deque
+from datetime import datetime
+from scheduler import ClusterCache, NodeInfo, Scheduler, least_allocated, most_allocated, MarginalPowerScorer
+
+NODES = ['cillium1', 'cillium2', 'cillium3', 'cillium4']
+TIMESTAMP_FORMAT = '%Y/%m/%d %H:%M:%S'
+# Columns a controller trace needs to be replayed
+CONTROLLER_COLUMNS = ('active_node_status', 'completed_batch_job', 'running_batch_job', 'pending_batch_job')
+
+ARRIVAL, COMPLETION, BOOTED, TICK = range(4)
+
+
+def active_nodes_from_status(status):
+    """
+    Decode ``active_node_status`` of the controller traces into the set of powered nodes.
+
+    cillium1 and cillium2 are always on, bit 1 switches cillium3 and bit 0 cillium4.
+    """
+    active = {'cillium1', 'cillium2'}
+    if status & 2:
+        active.add('cillium3')
+    if status & 1:
+        active.add('cillium4')
+    return active
+
+
+class Job:
+    __slots__ = ('id', 'arrival', 'cpu', 'memory', 'duration', 'start', 'finish', 'node')
+
+    def __init__(self, id, arrival, cpu, memory, duration):
+        self.id = id
+        self.arrival = arrival
+        self.cpu = cpu
+        self.memory = memory
+        self.duration = duration
+        self.start = None
+        self.finish = None
+        self.node = None
+
+
+class JobTrace:
+    """
+    Batch job arrivals and node on/off decisions recovered from a recorded trace.
+
+    Controller traces such as ``dataset/state.csv`` only log job counters, so a job arrives
+    whenever ``completed + running + pending`` grows, and job durations are drawn from an
+    exponential distribution whose mean follows from Little's law (mean running jobs
+    divided by the arrival rate).
+
+    Monitor traces such as ``dataset/profile-no-controller.csv``, or a directory written by
+    ``monitor_store``, log the CPU requests of every node instead. A rise of
+    ``cpu_reserve`` is a batch of jobs arriving, split into ``job_cpu`` sized jobs that
+    share the rise of ``mem_reserve``. Requests of completed pods stay counted until the
+    pod is deleted, so a batch ends when the reserve of its node falls (latest jobs
+    first), when the next batch starts on its node (the profiling runs start one batch
+    after the other), or at the end of the trace. The cores of a node are estimated from
+    how its CPU usage follows the running batch load, and the recorded ``Power`` is
+    integrated into ``recorded_energy_Wh`` to check the simulated energy against.
+    """
+
+    def __init__(self, path, job_cpu=0.1, job_memory=64 * 2**20, seed=0):
+        """
+        :param path: A controller trace, a ``monitor_cluster`` CSV or a ``monitor_store`` directory.
+        :param job_cpu: CPU cores requested by every job.
+        :param job_memory: Memory bytes requested by every job of a controller trace.
+        :param seed: Seed of the job duration draw of a controller trace.
+        :raises ValueError: If ``path`` is neither a controller nor a monitor trace.
+        """
+        import os
+        import monitor_store
+
+        self.name = path
+        self.nodes = list(NODES)
+        self.cores = None
+        self.recorded_energy_Wh = math.nan
+        if os.path.isdir(path):
+            self._read_monitor(monitor_store.load(path), job_cpu)
+            return
+        with open(path, newline='') as file:
+            header = next(csv.reader(file), [])
+        if monitor_store.is_legacy(path):
+            import tempfile
+
+            with tempfile.TemporaryDirectory() as directory:
+                monitor_store.convert(path, directory)
+                self._read_monitor(monitor_store.load(directory), job_cpu)
+        elif set(CONTROLLER_COLUMNS) <= set(header):
+            self._read_controller(path, job_cpu, job_memory, seed)
+        else:
+            raise ValueError(f"{path} is neither a controller trace with {', '.join(CONTROLLER_COLUMNS)} "
+                             f"nor a monitor_cluster trace")
+
+    def _read_controller(self, csv_file, job_cpu, job_memory, seed):
+        times, active, arrivals, running = [], [], [], []
+        previous_total = 0
+        with open(csv_file, newline='') as file:
+            for row in csv.DictReader(file):
+                t = datetime.strptime(row['timestamp'], TIMESTAMP_FORMAT).timestamp()
+                if times and t < times[-1]:
+                    continue
+                total = sum(int(row[key]) for key in ('completed_batch_job', 'running_batch_job', 'pending_batch_job'))
+                times.append(t)
+                active.append(frozenset(active_nodes_from_status(int(row['active_node_status']))))
+                arrivals.append(max(total - previous_total, 0))
+                running.append(int(row['running_batch_job']))
+                previous_total = total
+
+        start = times[0]
+        self.times = [t - start for t in times]
+        self.active = active
+        self.duration = self.times[-1]
+        count = sum(arrivals)
+        mean_duration = (sum(running) / len(running)) / (count / self.duration) if count else 0.0
+
+        rng = random.Random(seed)
+        self.jobs = []
+        for t, n in zip(self.times, arrivals):
+            for _ in range(n):
+                self.jobs.append(Job(len(self.jobs), t, job_cpu, job_memory, rng.expovariate(1 / mean_duration)))
+        self.mean_duration = mean_duration
+
+    def _read_monitor(self, df, job_cpu):
+        import numpy as np
+        import monitor_store
+
+        status = monitor_store.node_columns(df, 'node_status')
+        self.nodes = sorted(status.columns)
+        status = status.fillna(0).astype(bool).to_numpy()
+        reserve, memory, usage = (monitor_store.node_columns(df, metric).reindex(columns=self.nodes)
+                                  for metric in ('cpu_reserve', 'mem_reserve', 'cpu_usage_percentage'))
+        reserve = reserve.ffill().fillna(0.0).to_numpy()
+        memory = memory.ffill().fillna(0.0).to_numpy()
+        seconds = (df['timestamp'] - df['timestamp'].iloc[0]).dt.total_seconds().to_numpy()
+        self.times = seconds.tolist()
+        self.active = [frozenset(node for node, on in zip(self.nodes, row) if on) for row in status]
+        self.duration = self.times[-1]
+
+        self.jobs = []
+        # Batch cores running on each node at every tick, for the core estimate
+        load = np.zeros_like(reserve)
+        for j, node in enumerate(self.nodes):
+            running, last_rise = [], None
+            for i in range(1, len(seconds)):
+                t, rise = self.times[i], float(reserve[i, j] - reserve[i - 1, j])
+                if rise > 0:
+                    # A rise spread over consecutive ticks is one batch
+                    if last_rise != i - 1:
+                        for job in running:
+                            job.duration = t - job.arrival
+                        running = []
+                    count = max(round(rise / job_cpu), 1)
+                    share = max(float(memory[i, j] - memory[i - 1, j]), 0.0) * 1e9 / count
+                    for _ in range(count):
+                        job = Job(len(self.jobs), t, rise / count, share, 0.0)
+                        self.jobs.append(job)
+                        running.append(job)
+                    last_rise = i
+                elif rise < 0:
+                    for _ in range(min(max(round(-rise / job_cpu), 1), len(running))):
+                        job = running.pop()
+                        job.duration = t - job.arrival
+                load[i, j] = sum(job.cpu for job in running)
+            for job in running:
+                job.duration = self.duration - job.arrival
+        self.jobs.sort(key=lambda job: job.arrival)
+        self.mean_duration = sum(job.duration for job in self.jobs) / len(self.jobs) if self.jobs else 0.0
+
+        # CPU usage in percent grows by 100 / cores per running core
+        usage = usage.to_numpy(float)
+        valid = status & ~np.isnan(usage)
+        if valid.any() and np.ptp(load[valid]) > 0:
+            slope = np.polyfit(load[valid], usage[valid], 1)[0]
+            if slope > 0:
+                self.cores = 100 / slope
+        power = df['Power'].to_numpy(float)
+        self.recorded_energy_Wh = float(np.nansum(power[:-1] * np.diff(seconds))) / 3600
+
+    def active_at(self, t):
+        """The set of nodes powered at trace time ``t``."""
+        return self.active[max(bisect_right(self.times, t) - 1, 0)]
+
+
+class ModelPower:
+    """Adapt a fitted ``power_model.PowerModel`` to the simulator's power callback."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, active, cpu):
+        return max(float(self.model.predict(active, cpu, [0.0] * len(cpu))[0]), 0.0)
+
+
+def always_on(sim):
+    """Baseline without a node controller, as in ``profile-no-controller.csv``."""
+    return set(sim.nodes)
+
+
+class ReplayController:
+    """Power nodes exactly as the recorded controller did."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __call__(self, sim):
+        return set(self.trace.active_at(sim.now))
+
+
+class ThresholdController:
+    """
+    Add a node while jobs wait or committed CPU is above ``high``, remove an empty one below ``low``.
+    """
+
+    def __init__(self, always=('cillium1', 'cillium2'), high=0.8, low=0.3):
+        self.always = set(always)
+        self.high = high
+        self.low = low
+
+    def __call__(self, sim):
+        active = set(sim.powered())
+        on = [sim.cache.nodes[name] for name in active]
+        allocatable = sum(node.cpu_allocatable for node in on)
+        utilization = sum(node.cpu_requested for node in on) / allocatable if allocatable else 1.0
+        if sim.pending or utilization > self.high:
+            off = [name for name in sim.nodes if name not in active]
+            if off:
+                active.add(off[0])
+        elif utilization < self.low:
+            idle = [name for name in active if name not in self.always and sim.cache.nodes[name].pods == 0]
+            if idle:
+                active.discard(idle[-1])
+        return active | self.always
+
+
+SCORERS = {
+    'least_allocated': lambda: least_allocated,
+    'most_allocated': lambda: most_allocated,
+    'marginal_power': MarginalPowerScorer,
+}
+
+CONTROLLERS = {
+    'always_on': lambda trace: always_on,
+    'replay': ReplayController,
+    'threshold': lambda trace: ThresholdController(),
+}
+
+
+class Simulation:
+    """
+    Discrete-event simulation of batch jobs on a cluster whose nodes can be powered off.
+
+    Events are job arrivals and completions, node boots and controller ticks, kept in one
+    heap. Jobs are placed by ``scheduler.Scheduler`` with any of its scorers over the
+    powered nodes; the controller callback returns the set of nodes that should be on at
+    every tick. Powering a node on takes ``boot_time`` seconds, a node told to power off
+    first drains its running jobs. Energy is integrated exactly between events, from the
+    ``power`` callback over per-node on/off flags and committed CPU percent; it defaults
+    to the ``power_model.SharedPowerModel`` fitted on ``dataset/profile-cpu.csv``, the
+    same model ``MarginalPowerScorer`` scores with.
+    """
+
+    def __init__(self, jobs, scorer, controller, nodes=NODES, power=None, cores=4.0, memory=16 * 2**30,
+                 boot_time=60.0, control_interval=15.0):
+        self.nodes = list(nodes)
+        self.jobs = jobs
+        self.controller = controller
+        if power is None:
+            import power_model
+            power = power_model.profile_model()
+        self.power = power
+        self.boot_time = boot_time
+        self.control_interval = control_interval
+        self.cache = ClusterCache()
+        for name in self.nodes:
+            info = self.cache.nodes[name] = NodeInfo(name)
+            info.cpu_allocatable = cores
+            info.mem_allocatable = memory
+            info.ready = True
+        self.scheduler = Scheduler(self.cache, scorer)
+        self.state = {name: 'on' for name in self.nodes}
+        self.events = []
+        self.sequence = 0
+        self.pending = deque()
+        self.now = 0.0
+        self.energy_J = 0.0
+        self.watts = 0.0
+        self.completed = 0
+        self.decisions = 0
+
+    def _push(self, t, kind, payload=None):
+        heapq.heappush(self.events, (t, self.sequence, kind, payload))
+        self.sequence += 1
+
+    def powered(self):
+        return [name for name in self.nodes if self.state[name] != 'off']
+
+    def _update_power(self):
+        active = [self.state[name] != 'off' for name in self.nodes]
+        cpu = [self.cache.nodes[name].cpu_requested / self.cache.nodes[name].cpu_allocatable * 100 for name in self.nodes]
+        self.watts = self.power(active, cpu)
+
+    def _place_pending(self):
+        while self.pending:
+            job = self.pending[0]
+            self.decisions += 1
+            node = self.scheduler.select_node(job.cpu, job.memory)
+            if node is None:
+                return
+            self.pending.popleft()
+            self.cache.nodes[node].cpu_requested += job.cpu
+            self.cache.nodes[node].mem_requested += job.memory
+            self.cache.nodes[node].pods += 1
+            self.cache.nodes[node].workloads += 1
+            job.node, job.start = node, self.now
+            self._push(self.now + job.duration, COMPLETION, job)
+
+    def _apply(self, desired):
+        for name in self.nodes:
+            node, state = self.cache.nodes[name], self.state[name]
+            if name in desired:
+                if state == 'off':
+                    self.state[name] = 'booting'
+                    self._push(self.now + self.boot_time, BOOTED, name)
+                elif state == 'draining':
+                    self.state[name] = 'on'
+                    node.ready = True
+            elif state == 'on':
+                node.ready = False
+                self.state[name] = 'off' if node.pods == 0 else 'draining'
+
+    def run(self):
+        """
+        Run until every job has completed.
+
+        :return: Dict with energy, job completion times, simulated and wall time and decision rate.
+        """
+        wall_start = time.perf_counter()
+        for job in self.jobs:
+            self._push(job.arrival, ARRIVAL, job)
+        self._push(0.0, TICK)
+        self._update_power()
+        remaining = len(self.jobs)
+
+        while self.events and remaining:
+            t, _, kind, payload = heapq.heappop(self.events)
+            self.energy_J += self.watts * (t - self.now)
+            self.now = t
+            if kind == ARRIVAL:
+                self.pending.append(payload)
+            elif kind == COMPLETION:
+                node = self.cache.nodes[payload.node]
+                node.cpu_requested -= payload.cpu
+                node.mem_requested -= payload.memory
+                node.pods -= 1
+                node.workloads -= 1
+                payload.finish = t
+                remaining -= 1
+                if self.state[payload.node] == 'draining' and node.pods == 0:
+                    self.state[payload.node] = 'off'
+            elif kind == BOOTED:
+                if self.state[payload] == 'booting':
+                    self.state[payload] = 'on'
+                    self.cache.nodes[payload].ready = True
+            elif kind == TICK:
+                self.decisions += 1
+                self._apply(self.controller(self))
+                self._push(t + self.control_interval, TICK)
+            self._place_pending()
+            self._update_power()
+
+        wall = time.perf_counter() - wall_start
+        jct = sorted(job.finish - job.arrival for job in self.jobs if job.finish is not None)
+        return {
+            'jobs': len(jct),
+            'energy_Wh': self.energy_J / 3600,
+            'mean_jct_s': sum(jct) / len(jct) if jct else math.nan,
+            'p95_jct_s': jct[int(len(jct) * 0.95)] if jct else math.nan,
+            'makespan_s': self.now,
+            'wall_s': wall,
+            'speedup': self.now / wall if wall else math.inf,
+            'decisions_per_s': self.decisions / wall if wall else math.inf,
+        }
+
+
+def run_scenario(trace_file, scorer, controller, options=None):
+    """
+    Simulate one trace under one scheduler scorer and node controller.
+
+    :param trace_file: A controller trace such as ``dataset/state.csv`` or a monitor trace
+                       such as ``dataset/profile-no-controller.csv``.
+    :param scorer: Key of ``SCORERS``.
+    :param controller: Key of ``CONTROLLERS``.
+    :param options: Extra ``Simulation`` keyword arguments.
+    :return: The ``Simulation.run`` result with the scenario keys added.
+    """
+    trace = JobTrace(trace_file)
+    options = {'nodes': trace.nodes, **({'cores': trace.cores} if trace.cores else {}), **(options or {})}
+    sim = Simulation(trace.jobs, SCORERS[scorer](), CONTROLLERS[controller](trace), **options)
+    return {'trace': trace_file, 'scorer': scorer, 'controller': controller, **sim.run(),
+            'recorded_Wh': trace.recorded_energy_Wh}
+
+
+def sweep(trace_files, scorers=tuple(SCORERS), controllers=tuple(CONTROLLERS), processes=None, options=None):
+    """
+    Run every trace, scorer and controller combination in a process pool.
+
+    :return: List of scenario results in submission order.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    scenarios = [(trace, scorer, controller, options)
+                 for trace in trace_files for scorer in scorers for controller in controllers]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(run_scenario, *scenario) for scenario in scenarios]
+        return [future.result() for future in futures]
+
+
+if __name__ == '__main__':
+    import sys
+
+    traces = sys.argv[1:] or ['dataset/state.csv', 'dataset/node_controller_state.csv',
+                              'dataset/profile-no-controller.csv']
+    start = time.perf_counter()
+    results = sweep(traces)
+    elapsed = time.perf_counter() - start
+
+    print(f"{'trace':40} {'scorer':16} {'controller':10} {'jobs':>5} {'energy Wh':>10} {'recorded Wh':>12} "
+          f"{'mean JCT s':>11} {'p95 JCT s':>10} {'speedup':>9} {'decisions/s':>12}")
+    for r in results:
+        print(f"{r['trace']:40} {r['scorer']:16} {r['controller']:10} {r['jobs']:5} {r['energy_Wh']:10.1f} "
+              f"{r['recorded_Wh']:12.1f} {r['mean_jct_s']:11.0f} {r['p95_jct_s']:10.0f} {r['speedup']:8.0f}x "
+              f"{r['decisions_per_s']:12.0f}")
+    print(f"{len(results)} scenarios in {elapsed:.1f} s")